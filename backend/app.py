@@ -1,13 +1,33 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import glob
 import json
 import os
 import uuid
 from datetime import datetime
 import base64
-import cv2
+import hashlib
+import struct
+import threading
+import time
 import numpy as np
-import face_recognition
+from concurrent.futures import TimeoutError as FutureTimeout
+from gallery import (FaceGallery, VersionConflict, convert_legacy, gallery_generation, person_templates,
+                     remove_persons, rename_person, save_gallery, set_person_encodings)
+from search_index import PersonSearchIndex
+from store import ABSENT_FIELDS, PERSON_FIELDS, PRESENCE_FIELDS, Store
+from journal import PresenceJournal
+from encode_jobs import EncodeAllJob, EnrollmentQueue
+from encoding_cache import EncodingCache, detect_and_encode
+from face_detection import detection_params, env_detection_params
+from recognition_service import RecognitionService, ServiceBusy, detect_frame, identify_frame, recognize_image
+from file_utils import atomic_write
+import atexit
+
+# OpenCV, dlib et face_recognition ne sont importés qu'à la première requête qui en a besoin
+# (detect_and_encode): les workers qui ne font que du CRUD ne les chargent pas.
+# /api/recognize, /api/recognize/batch et la détection/l'identification des flux s'exécutent dans les
+# processus de recognition_service; les routes de flux ne gardent ici que le décodage et le suivi optique (OpenCV).
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
@@ -19,55 +39,254 @@ DATA_FOLDER = 'data'
 PERSONS_FILE = os.path.join(DATA_FOLDER, 'personnes.json')
 PRESENCE_FILE = os.path.join(DATA_FOLDER, 'presence.json')
 ABSENT_FILE = os.path.join(DATA_FOLDER, 'absent.json')
-ENCODINGS_FILE = os.path.join(DATA_FOLDER, 'encodings.npy')  # Fichier pour les encodages faciaux
-NAMES_FILE = os.path.join(DATA_FOLDER, 'names.npy')         # Fichier pour les noms associés
+DB_FILE = os.path.join(DATA_FOLDER, 'pointage.db')          # Base SQLite (personnes, présences, absences)
+JOURNAL_FOLDER = os.path.join(DATA_FOLDER, 'journal')       # Journal append-only des pointages
+ENCODE_CHECKPOINT_FILE = os.path.join(DATA_FOLDER, 'encode_checkpoint.json')  # Reprise du ré-encodage
+ENCODING_CACHE_FOLDER = os.path.join(DATA_FOLDER, 'encoding_cache')  # Cache des encodages par hash d'image
+ENCODINGS_FILE = os.path.join(DATA_FOLDER, 'encodings.npy')  # Ancien format des encodages (converti au démarrage)
+NAMES_FILE = os.path.join(DATA_FOLDER, 'names.npy')         # Ancien format des noms associés
+GALLERY_FILE = os.path.join(DATA_FOLDER, 'gallery.bin')     # Galerie binaire: encodages float32 + person_id
+GALLERY_INDEX = os.environ.get('GALLERY_INDEX', 'flat')      # 'flat' (exact) ou 'ivf' (approché, grandes galeries)
+STREAM_MAX_FRAME_BYTES = 5 * 1024 * 1024                    # Taille maximale d'une image du flux
+STREAM_SESSION_TTL = float(os.environ.get('STREAM_SESSION_TTL', 60))  # Suivi d'une session /api/recognize/frame inactive (s)
+MAX_STREAM_SESSIONS = 100                                   # Sessions de suivi gardées par worker
+RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', 0)) or None   # Processus de reconnaissance (défaut: CPU / WEB_CONCURRENCY)
+RECOGNITION_QUEUE = int(os.environ.get('RECOGNITION_QUEUE', 0)) or None       # Requêtes en attente avant 503 (défaut: 4 par processus)
+RECOGNITION_TIMEOUT = float(os.environ.get('RECOGNITION_TIMEOUT', 10))        # Délai par requête avant 504 (secondes)
+MAX_CAPTURES = 10                                                             # Captures par upload
+STAGED_TTL = float(os.environ.get('STAGED_TTL', 24 * 3600))                    # Durée de vie des captures sans personne (s)
+# Détection par endpoint: détecteur, suréchantillonnage et échelles essayées de la plus petite à la plus grande.
+# Surchargeable par l'environnement (ex. RECOGNIZE_FACE_DETECTOR=cnn, ENROLL_DETECTION_LADDER=0.25,1)
+# et par requête (?detector=haar&upsample=0&ladder=0.25,0.5,1).
+DETECTION = {
+    'recognize': env_detection_params({'model': 'hog', 'upsample': 1, 'ladder': [0.25, 0.5, 1.0]}, 'RECOGNIZE_'),
+    'batch': env_detection_params({'model': 'hog', 'upsample': 1, 'ladder': [1.0]}, 'BATCH_'),  # photos de groupe: petits visages
+    'enroll': env_detection_params({'model': 'hog', 'upsample': 1, 'ladder': [0.5, 1.0]}, 'ENROLL_'),
+    'stream': env_detection_params({'model': 'hog', 'upsample': 1, 'ladder': [1.0]}, 'STREAM_'),
+}
+
+# Services du processus serveur, créés par init() et non à l'import: avec la méthode spawn
+# (Windows, macOS), chaque processus des pools ré-importe ce module.
+store = None
+search_index = None
+gallery = None
+encoding_cache = None
+encode_job = None
+enrollment_queue = None
+recognition = None
+journal = None
+_init_lock = threading.Lock()
+
+# Les captures enrôlées en attente de la création de la personne sont dans le stockage
+# (store.staged_captures), visibles par tous les workers.
 
-# Créer les dossiers nécessaires
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
+def capture_filename(filename, position):
+    """Fichier de la n-ième capture d'une personne: uuid.jpg, puis uuid.2.jpg, uuid.3.jpg..."""
+    if position == 0:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{position + 1}{ext}'
 
-# Initialiser les fichiers de reconnaissance faciale s'ils n'existent pas
-if not os.path.exists(ENCODINGS_FILE):
-    np.save(ENCODINGS_FILE, np.array([], dtype=object))
-if not os.path.exists(NAMES_FILE):
-    np.save(NAMES_FILE, np.array([], dtype=object))
+def capture_paths(image_filename):
+    """Chemins de toutes les captures d'une personne, l'image principale d'abord"""
+    filename = os.path.basename(image_filename)
+    stem, ext = os.path.splitext(filename)
+    extra = glob.glob(os.path.join(UPLOAD_FOLDER, f'{glob.escape(stem)}.*{ext}'))
+    extra = [path for path in extra if os.path.basename(path)[len(stem) + 1:-len(ext) or None].isdigit()]
+    extra.sort(key=lambda path: int(os.path.basename(path)[len(stem) + 1:-len(ext) or None]))
+    return [os.path.join(UPLOAD_FOLDER, filename)] + extra
 
+def enroll_face(content, face_encoding, job):
+    """Contrôle des doublons puis enregistrement d'une capture (file d'enrôlement).
 
-# Créer les dossiers nécessaires
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
+    Les captures d'un même upload doivent montrer la même personne; un
+    visage déjà en galerie n'est accepté que pour la personne visée
+    (job['person_id'], nouvelles captures d'une personne existante).
+    """
+    group = job['filename']
+    store.prune_staged(STAGED_TTL)
+    gallery.refresh()
+    for existing_id, _, distance in gallery.search(face_encoding, k=2):
+        if existing_id != job.get('person_id') and distance <= gallery.tolerance:
+            raise ValueError('Ce visage est déjà enregistré dans le système')
+    staged = store.staged_captures()
+    for other, captures in staged.items():
+        distances = np.linalg.norm(np.asarray([encoding for _, encoding in captures]) - face_encoding, axis=1)
+        if other != group and distances.min() <= gallery.tolerance:
+            raise ValueError('Ce visage vient déjà d\'être uploadé')
+        if other == group and distances.min() > gallery.tolerance:
+            raise ValueError('Cette capture ne correspond pas aux autres captures de la personne')
+    position = len(staged.get(group, []))
+    filename = capture_filename(group, position)
+    atomic_write(os.path.join(UPLOAD_FOLDER, filename), content)
+    store.stage_capture(group, job['quality']['score'], face_encoding)
+    return {'path': f'/uploads/images/{filename}', 'capture': position + 1}
 
-def load_json_file(filename, default=[]):
-    """Charger un fichier JSON"""
-    if os.path.exists(filename):
+def save_person_face(person_id, nom, face_encodings, attempts=3):
+    """Enregistrer les modèles d'une personne après contrôle des doublons sur la galerie à jour.
+
+    `face_encodings` sont ses captures, les meilleures d'abord. Contrôle
+    optimiste: si la galerie change entre le contrôle et l'écriture (autre
+    worker, main.py), le contrôle est refait sur la nouvelle version.
+    """
+    templates = person_templates(face_encodings)
+    for attempt in range(attempts):
+        generation = gallery_generation(GALLERY_FILE)
+        gallery.refresh()
+        # k=2: la personne elle-même peut déjà figurer dans la galerie (changement d'image)
+        for neighbours in gallery.search_many(templates, k=2):
+            for existing_id, _, distance in neighbours:
+                if existing_id != person_id and distance <= gallery.tolerance:
+                    raise ValueError('Ce visage est déjà enregistré dans le système')
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Erreur lors du chargement de {filename}: {e}")
-    return default
+            return set_person_encodings(GALLERY_FILE, person_id, nom, templates,
+                                        expected_generation=generation)
+        except VersionConflict:
+            if attempt == attempts - 1:
+                raise
 
-def save_json_file(filename, data):
-    """Sauvegarder un fichier JSON"""
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"Erreur lors de la sauvegarde de {filename}: {e}")
-        return False
+def enrolled_encodings(image_filename):
+    """Encodages des captures d'une image uploadée, les meilleures d'abord (mis de côté à l'enrôlement, sinon via le cache)"""
+    filename = os.path.basename(image_filename)
+    captures = store.staged_captures(filename).get(filename)
+    if captures:
+        return [encoding for _, encoding in sorted(captures, key=lambda capture: -capture[0])]
+    paths = [path for path in capture_paths(filename) if os.path.exists(path)]
+    if not paths:
+        raise ValueError('Image non trouvée')
+    encodings = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            _, _, face_encodings, _ = detect_and_encode(f.read(), cache=encoding_cache, params=DETECTION['enroll'])
+        encodings.extend(face_encodings[:1])
+    if not encodings:
+        raise ValueError('Aucun visage détecté dans l\'image')
+    return encodings
+
+def init():
+    """Créer le stockage, la galerie, les pools et le journal (une fois par processus serveur).
+
+    Appelé par `__main__`, par le hook post_worker_init de gunicorn.conf.py
+    et, à défaut, avant la première requête.
+    """
+    global store, search_index, gallery, encoding_cache, encode_job, enrollment_queue, recognition, journal
+    with _init_lock:
+        if journal is not None:
+            return
+        # Créer les dossiers nécessaires
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+
+        # Stockage des personnes, présences et absences (import unique des anciens fichiers JSON)
+        store = Store(DB_FILE)
+        store.migrate_from_json(PERSONS_FILE, PRESENCE_FILE, ABSENT_FILE)
+
+        # Initialiser la galerie binaire (conversion des anciens fichiers .npy s'ils existent)
+        if not os.path.exists(GALLERY_FILE):
+            if os.path.exists(ENCODINGS_FILE) and os.path.exists(NAMES_FILE):
+                convert_legacy(ENCODINGS_FILE, NAMES_FILE, store.list_persons(), GALLERY_FILE)
+            else:
+                save_gallery(GALLERY_FILE, [], [])
+
+        # Index de recherche des personnes (construit à la première recherche)
+        search_index = PersonSearchIndex(store)
+
+        # Galerie partagée par toutes les requêtes du processus
+        gallery = FaceGallery(GALLERY_FILE, index=GALLERY_INDEX)
+
+        # Cache des détections/encodages, partagé par l'upload et le ré-encodage
+        encoding_cache = EncodingCache(ENCODING_CACHE_FOLDER)
+
+        # Ré-encodage complet en tâche de fond (pool de processus)
+        encode_job = EncodeAllJob(ENCODE_CHECKPOINT_FILE, GALLERY_FILE, store, cache=encoding_cache,
+                                  params=DETECTION['enroll'])
+
+        # Enrôlement asynchrone des images uploadées
+        enrollment_queue = EnrollmentQueue(enroll_face, store, cache=encoding_cache,
+                                           lock_path=os.path.join(DATA_FOLDER, 'enrollment'))
+        atexit.register(enrollment_queue.close)
+
+        # Reconnaissance dans des processus dédiés: les requêtes CRUD ne partagent pas le GIL avec dlib
+        recognition = RecognitionService(GALLERY_FILE, workers=RECOGNITION_WORKERS, max_pending=RECOGNITION_QUEUE,
+                                         timeout=RECOGNITION_TIMEOUT, index=GALLERY_INDEX,
+                                         warm_up=os.environ.get('WARMUP') == '1')
+        atexit.register(recognition.close)
+
+        # Les pointages passent par le journal, compacté en arrière-plan dans le stockage
+        journal = PresenceJournal(store, JOURNAL_FOLDER)
+        journal.start()
+        atexit.register(journal.close)
+
+@app.before_request
+def ensure_init():
+    # Serveur lancé sans passer par __main__ ni gunicorn.conf.py (ex. flask run)
+    if journal is None:
+        init()
+
+def list_page(table, fields, filters=None, default_sort=None, default_descending=False, etag_extra=''):
+    """Réponse paginée d'une route de liste.
+
+    Paramètres de requête: limit et cursor (pagination par curseur), sort
+    (champ, préfixé par '-' pour l'ordre décroissant) et fields (projection,
+    champs séparés par des virgules). Sans limit, toute la liste est renvoyée
+    comme avant. Renvoie (items, next_cursor, total, etag) ou, si le client a
+    déjà cette version (If-None-Match), (None, None, None, etag).
+    """
+    sort = request.args.get('sort')
+    descending = default_descending
+    if sort:
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+    else:
+        sort = default_sort
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, 1000))
+
+    # La version de la table change à chaque écriture: l'ETag est connu sans lire les lignes
+    etag = hashlib.sha1(f"{table}:{store.table_version(table)}:{etag_extra}:{request.full_path}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        return None, None, None, etag
+
+    if request.args.get('fields'):
+        selected = [f for f in request.args['fields'].split(',') if f in fields]
+    else:
+        selected = fields
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = json.loads(base64.urlsafe_b64decode(request.args['cursor'].encode()))
+        except Exception:
+            raise ValueError('Curseur invalide')
+    items, last, total = store.page(table, selected or fields, filters, sort, descending, limit, after)
+    next_cursor = base64.urlsafe_b64encode(json.dumps(last).encode()).decode() if last else None
+    return items, next_cursor, total, etag
+
+def list_response(body, etag):
+    """Réponse JSON avec ETag, ou 304 si le client a déjà cette version"""
+    if body is None:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(body)
+    response.set_etag(etag)
+    return response
 
 # Routes pour les personnes
 @app.route('/api/persons', methods=['GET'])
 def get_persons():
     """Récupérer toutes les personnes"""
     try:
-        persons = load_json_file(PERSONS_FILE)
-        return jsonify({
+        persons, next_cursor, total, etag = list_page('persons', PERSON_FIELDS)
+        if persons is None:
+            return list_response(None, etag)
+        return list_response({
             'success': True,
             'data': persons,
-            'total': len(persons)
-        })
+            'total': total,
+            'next_cursor': next_cursor
+        }, etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -75,8 +294,7 @@ def get_persons():
 def get_person(person_id):
     """Récupérer une personne par ID"""
     try:
-        persons = load_json_file(PERSONS_FILE)
-        person = next((p for p in persons if p['id'] == person_id), None)
+        person = store.get_person(person_id)
         
         if person:
             return jsonify({'success': True, 'data': person})
@@ -100,21 +318,19 @@ def add_person():
                     'message': f'Le champ {field} est requis'
                 }), 400
         
-        persons = load_json_file(PERSONS_FILE)
-        
         # Vérifier si l'email existe déjà
-        if any(p['email'] == data['email'] for p in persons):
+        if store.find_person_by_email(data['email']):
             return jsonify({
                 'success': False, 
                 'message': 'Cette adresse email existe déjà'
             }), 400
         
-        # Charger les encodages existants
-        known_face_names = np.load(NAMES_FILE, allow_pickle=True).tolist()
-        
-        # Associer le nom au dernier encodage ajouté
-        known_face_names.append(data['nom'])
-        np.save(NAMES_FILE, np.array(known_face_names, dtype=object))
+        # L'image doit avoir fini d'être enrôlée avant de créer la personne
+        if enrollment_queue.in_progress(os.path.basename(data['image_filename'])):
+            return jsonify({
+                'success': False,
+                'message': 'Enrôlement de l\'image en cours, réessayez dans un instant'
+            }), 409
         
         # Créer une nouvelle personne
         new_person = {
@@ -129,19 +345,29 @@ def add_person():
             'active': True
         }
         
-        persons.append(new_person)
+        try:
+            face_encodings = enrolled_encodings(data['image_filename'])
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        if save_json_file(PERSONS_FILE, persons):
-            return jsonify({
-                'success': True, 
-                'message': 'Personne ajoutée avec succès',
-                'data': new_person
-            }), 201
-        else:
-            return jsonify({
-                'success': False, 
-                'message': 'Erreur lors de la sauvegarde'
-            }), 500
+        # Personne et encodages sont ajoutés ensemble: la personne est retirée si la galerie échoue
+        version = store.table_version('persons')
+        store.add_person(new_person)
+        try:
+            save_person_face(new_person['id'], new_person['nom'], face_encodings)
+        except Exception as e:
+            store.delete_person(new_person['id'])
+            if isinstance(e, ValueError):
+                return jsonify({'success': False, 'message': str(e)}), 400
+            raise
+        store.drop_staged(os.path.basename(data['image_filename']))
+        search_index.updated(version, person=new_person)
+        
+        return jsonify({
+            'success': True, 
+            'message': 'Personne ajoutée avec succès',
+            'data': new_person
+        }), 201
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -150,32 +376,50 @@ def update_person(person_id):
     """Modifier une personne"""
     try:
         data = request.get_json()
-        persons = load_json_file(PERSONS_FILE)
-        
-        person_index = next((i for i, p in enumerate(persons) if p['id'] == person_id), None)
         
-        if person_index is None:
+        previous = store.get_person(person_id)
+        if not previous:
             return jsonify({'success': False, 'message': 'Personne non trouvée'}), 404
         
         # Mettre à jour les champs
         updatable_fields = ['nom', 'email', 'telephone', 'poste', 'departement', 'active']
-        for field in updatable_fields:
-            if field in data:
-                persons[person_index][field] = data[field]
+        changes = {field: data[field] for field in updatable_fields if field in data}
         
-        persons[person_index]['date_modification'] = datetime.now().isoformat()
+        # Nouvelle image: ses captures remplacent les modèles de la personne
+        face_encodings = None
+        if data.get('image_filename') and data['image_filename'] != previous.get('image'):
+            if enrollment_queue.in_progress(os.path.basename(data['image_filename'])):
+                return jsonify({
+                    'success': False,
+                    'message': 'Enrôlement de l\'image en cours, réessayez dans un instant'
+                }), 409
+            try:
+                face_encodings = enrolled_encodings(data['image_filename'])
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+            changes['image'] = data['image_filename']
+        
+        changes['date_modification'] = datetime.now().isoformat()
+        version = store.table_version('persons')
+        person = store.update_person(person_id, changes)
+        try:
+            if face_encodings is not None:
+                save_person_face(person_id, person['nom'], face_encodings)
+                store.drop_staged(os.path.basename(data['image_filename']))
+            elif person['nom'] != previous['nom']:
+                rename_person(GALLERY_FILE, person_id, person['nom'])
+        except Exception as e:
+            store.update_person(person_id, {field: previous.get(field) for field in changes})
+            if isinstance(e, ValueError):
+                return jsonify({'success': False, 'message': str(e)}), 400
+            raise
+        search_index.updated(version, person=person)
         
-        if save_json_file(PERSONS_FILE, persons):
-            return jsonify({
-                'success': True, 
-                'message': 'Personne modifiée avec succès',
-                'data': persons[person_index]
-            })
-        else:
-            return jsonify({
-                'success': False, 
-                'message': 'Erreur lors de la sauvegarde'
-            }), 500
+        return jsonify({
+            'success': True, 
+            'message': 'Personne modifiée avec succès',
+            'data': person
+        })
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -184,29 +428,34 @@ def update_person(person_id):
 def delete_person(person_id):
     """Supprimer une personne"""
     try:
-        persons = load_json_file(PERSONS_FILE)
-        person = next((p for p in persons if p['id'] == person_id), None)
-        
-        if not person:
+        if not store.get_person(person_id):
             return jsonify({'success': False, 'message': 'Personne non trouvée'}), 404
         
-        # Supprimer la personne
-        persons = [p for p in persons if p['id'] != person_id]
+        # La personne d'abord: un ré-encodage en cours ne peut plus la remettre dans la galerie
+        version = store.table_version('persons')
+        store.delete_person(person_id)
+        remove_persons(GALLERY_FILE, [person_id])
+        search_index.updated(version, removed_id=person_id)
         
-        if save_json_file(PERSONS_FILE, persons):
-            return jsonify({
-                'success': True, 
-                'message': 'Personne supprimée avec succès'
-            })
-        else:
-            return jsonify({
-                'success': False, 
-                'message': 'Erreur lors de la suppression'
-            }), 500
+        return jsonify({
+            'success': True, 
+            'message': 'Personne supprimée avec succès'
+        })
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
     
+def request_detection(endpoint):
+    """Paramètres de détection de l'endpoint, surchargés par la requête (ValueError si invalides)"""
+    return detection_params(DETECTION[endpoint], request.args.get('detector'),
+                            request.args.get('upsample'), request.args.get('ladder'))
+
+def recognition_busy(error):
+    """Réponse 503 quand la file de reconnaissance est pleine"""
+    response = jsonify({'success': False, 'message': f'Service de reconnaissance saturé: {error}'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/api/recognize', methods=['POST'])
 def recognize_face():
     """Reconnaître un visage à partir d'une image"""
@@ -218,116 +467,319 @@ def recognize_face():
         if file.filename == '':
             return jsonify({'success': False, 'message': 'Aucun fichier sélectionné'}), 400
         
-        # Sauvegarde temporaire
-        temp_filename = f"temp_{uuid.uuid4()}.jpg"
-        temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-        file.save(temp_path)
+        # Détection, encodage et comparaison dans un processus de reconnaissance
+        faces = recognition.call(recognize_image, file.read(), 1, False, request_detection('recognize'))
         
-        # Charger l'image
-        unknown_image = face_recognition.load_image_file(temp_path)
-        face_locations = face_recognition.face_locations(unknown_image)
-        
-        if not face_locations:
-            os.remove(temp_path)
+        if not faces:
             return jsonify({
                 'success': False,
                 'message': 'Aucun visage détecté dans l\'image'
             }), 400
         
-        # Encodage du visage inconnu
-        unknown_encoding = face_recognition.face_encodings(unknown_image, [face_locations[0]])[0]
-        
-        # Charger les encodages connus
-        known_face_encodings = np.load(ENCODINGS_FILE, allow_pickle=True).tolist()
-        known_face_names = np.load(NAMES_FILE, allow_pickle=True).tolist()
-        
-        # Comparer avec les visages connus
-        matches = face_recognition.compare_faces(known_face_encodings, unknown_encoding)
-        name = "Inconnu"
-        
-        if True in matches:
-            first_match_index = matches.index(True)
-            name = known_face_names[first_match_index]
-        
-        # Nettoyer le fichier temporaire
-        os.remove(temp_path)
-        
+        face = faces[0]
         return jsonify({
             'success': True,
-            'recognized': name != "Inconnu",
-            'name': name,
+            'recognized': face['recognized'],
+            'name': face['name'],
+            'person_id': face['person_id'],
+            'distance': face['distance'],
             'message': 'Reconnaissance terminée'
         })
         
+    except ServiceBusy as e:
+        return recognition_busy(e)
+    except TimeoutError as e:
+        return jsonify({'success': False, 'message': str(e)}), 504
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/api/encode-all', methods=['POST'])
-def encode_all_faces():
-    """Encoder tous les visages des personnes existantes"""
+@app.route('/api/recognize/batch', methods=['POST'])
+def recognize_faces_batch():
+    """Reconnaître tous les visages de plusieurs images (ou d'une photo de groupe)"""
     try:
-        persons = load_json_file(PERSONS_FILE)
-        known_face_encodings = []
-        known_face_names = []
-        
-        for person in persons:
-            if person.get('image'):
+        files = request.files.getlist('images') + request.files.getlist('image')
+        files = [f for f in files if f.filename]
+        if not files:
+            return jsonify({'success': False, 'message': 'Aucune image fournie'}), 400
+
+        k = max(1, min(int(request.args.get('k', 1)), 10))
+        detection = request_detection('batch')
+
+        # Une tâche par image: les images sont traitées en parallèle par les processus de reconnaissance
+        futures = []
+        try:
+            for file in files:
+                futures.append(recognition.submit(recognize_image, file.read(), k, True, detection))
+        except ServiceBusy:
+            for pending in futures:
+                pending.cancel()
+            raise
+        deadline = time.monotonic() + recognition.timeout
+        results = []
+        for file, future in zip(files, futures):
+            try:
+                faces = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                for pending in futures:
+                    pending.cancel()
+                return jsonify({'success': False, 'message': 'Délai de reconnaissance dépassé'}), 504
+            results.append({'filename': file.filename, 'faces': faces})
+
+        return jsonify({
+            'success': True,
+            'data': results,
+            'total_faces': sum(len(result['faces']) for result in results),
+            'message': 'Reconnaissance terminée'
+        })
+
+    except ServiceBusy as e:
+        return recognition_busy(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def read_frames(stream):
+    """Images du flux: chacune précédée de sa taille sur 4 octets (big-endian), 0 pour terminer"""
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+        size, = struct.unpack('>I', header)
+        if size == 0:
+            return
+        if size > STREAM_MAX_FRAME_BYTES:
+            raise ValueError(f"Image trop volumineuse dans le flux ({size} octets)")
+        data = b''
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if not chunk:
+                return
+            data += chunk
+        yield data
+
+class TrackingSession:
+    """Suivi des visages d'une suite d'images (flux ou session /api/recognize/frame).
+
+    Les images d'une session sont traitées une à une (le suivi dépend de
+    l'image précédente). Détection et encodage passent par le pool de
+    reconnaissance, qui relit la galerie quand elle change: les personnes
+    enrôlées pendant la session sont reconnues. ServiceBusy et TimeoutError
+    du pool remontent à l'appelant.
+    """
+
+    def __init__(self, detection, scale, redetect_every):
+        from face_tracker import FaceTracker
+        self.scale = scale
+        self.tracker = FaceTracker(lambda rgb: recognition.call(detect_frame, rgb, detection),
+                                   lambda rgb, boxes: recognition.call(identify_frame, rgb, boxes),
+                                   redetect_every=redetect_every)
+        self.announced = set()
+        self.frames = 0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def process(self, data):
+        """Suivre les visages d'une image: renvoie (numéro d'image, visages, événements 'recognized')"""
+        import cv2
+        from image_io import decode_image, scale_boxes
+        with self.lock:
+            frame_id = self.frames
+            self.frames += 1
+            self.last_seen = time.monotonic()
+            rgb, decode_scale = decode_image(data)
+            if self.scale < 1.0:
+                rgb = cv2.resize(rgb, (0, 0), fx=self.scale, fy=self.scale)
+
+            faces, recognized = [], []
+            for track in self.tracker.update(rgb):
+                top, right, bottom, left = scale_boxes([track.box], self.scale * decode_scale)[0]
+                faces.append({
+                    'track_id': track.track_id,
+                    'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+                    'recognized': track.identified,
+                    'name': track.name,
+                    'person_id': track.person_id,
+                    'distance': track.distance,
+                })
+                if track.identified and track.track_id not in self.announced:
+                    self.announced.add(track.track_id)
+                    recognized.append({'event': 'recognized', 'frame': frame_id, 'track_id': track.track_id,
+                                       'name': track.name, 'person_id': track.person_id,
+                                       'distance': track.distance})
+            return frame_id, faces, recognized
+
+
+def tracking_params():
+    """Paramètres de suivi de la requête: (détection, scale, redetect_every); ValueError si invalides"""
+    scale = min(max(float(request.args.get('scale', 1.0)), 0.1), 1.0)
+    redetect_every = max(1, int(request.args.get('redetect_every', 5)))
+    return request_detection('stream'), scale, redetect_every
+
+# Sessions de suivi de /api/recognize/frame, propres à chaque worker
+stream_sessions = {}
+stream_sessions_lock = threading.Lock()
+
+def tracking_session(session_id):
+    """Session de suivi existante, ou None; les sessions inactives sont oubliées"""
+    now = time.monotonic()
+    with stream_sessions_lock:
+        for expired in [key for key, session in stream_sessions.items()
+                        if now - session.last_seen > STREAM_SESSION_TTL]:
+            del stream_sessions[expired]
+        return stream_sessions.get(session_id)
+
+def new_tracking_session(detection, scale, redetect_every):
+    session_id = str(uuid.uuid4())
+    session = TrackingSession(detection, scale, redetect_every)
+    with stream_sessions_lock:
+        if len(stream_sessions) >= MAX_STREAM_SESSIONS:
+            del stream_sessions[min(stream_sessions, key=lambda key: stream_sessions[key].last_seen)]
+        stream_sessions[session_id] = session
+    return session_id, session
+
+@app.route('/api/recognize/frame', methods=['POST'])
+def recognize_frame():
+    """Reconnaissance image par image avec suivi (navigateurs: une requête courte par image).
+
+    Le corps est l'image (JPEG/PNG, brute ou champ multipart 'image'). Sans
+    paramètre `session`, une session de suivi est créée et son identifiant
+    renvoyé; les images suivantes la réutilisent (scale et redetect_every
+    sont ceux de la création). La session est propre au worker: si une
+    image arrive sur un autre worker ou après expiration, une nouvelle
+    session est ouverte et renvoyée.
+    """
+    try:
+        if 'image' in request.files:
+            data = request.files['image'].read()
+        else:
+            data = request.get_data()
+        if not data:
+            return jsonify({'success': False, 'message': 'Aucune image fournie'}), 400
+        if len(data) > STREAM_MAX_FRAME_BYTES:
+            return jsonify({'success': False, 'message': f"Image trop volumineuse ({len(data)} octets)"}), 413
+
+        session_id = request.args.get('session')
+        session = tracking_session(session_id) if session_id else None
+        if session is None:
+            session_id, session = new_tracking_session(*tracking_params())
+        frame_id, faces, recognized = session.process(data)
+        return jsonify({
+            'success': True,
+            'session': session_id,
+            'frame': frame_id,
+            'faces': faces,
+            'recognized': recognized
+        })
+    except ServiceBusy as e:
+        return recognition_busy(e)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'Délai de reconnaissance dépassé'}), 504
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/recognize/stream', methods=['POST'])
+def recognize_stream():
+    """Reconnaissance continue sur une seule connexion (clients hors navigateur).
+
+    Le corps de la requête (transfert chunked) est une suite d'images JPEG/PNG
+    préfixées par leur taille; la réponse est un flux NDJSON avec, pour chaque
+    image, les visages suivis, et un événement 'recognized' dès qu'un visage
+    est identifié. Le suivi des visages est propre à la connexion. Les
+    navigateurs n'envoient pas de corps en flux tout en lisant la réponse:
+    ils passent par /api/recognize/frame.
+    """
+    try:
+        session = TrackingSession(*tracking_params())
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    stream = request.stream
+
+    def events():
+        frames = 0
+        try:
+            for data in read_frames(stream):
+                start = time.perf_counter()
                 try:
-                    image_path = os.path.join(UPLOAD_FOLDER, os.path.basename(person['image']))
-                    if os.path.exists(image_path):
-                        image = face_recognition.load_image_file(image_path)
-                        face_locations = face_recognition.face_locations(image)
-                        
-                        if face_locations:
-                            encoding = face_recognition.face_encodings(image, [face_locations[0]])[0]
-                            known_face_encodings.append(encoding)
-                            known_face_names.append(person['nom'])
-                except Exception as e:
-                    print(f"Erreur avec {person['nom']}: {str(e)}")
+                    frame_id, faces, recognized = session.process(data)
+                except (ValueError, ServiceBusy, TimeoutError) as e:
+                    # Image illisible, pool saturé ou trop lent: on passe à l'image suivante
+                    yield json.dumps({'event': 'error', 'frame': frames, 'message': str(e)}) + '\n'
+                    frames += 1
                     continue
+                for event in recognized:
+                    yield json.dumps(event) + '\n'
+                yield json.dumps({'event': 'faces', 'frame': frame_id, 'faces': faces,
+                                  'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}) + '\n'
+                frames += 1
+        except Exception as e:
+            yield json.dumps({'event': 'error', 'frame': frames, 'message': str(e)}) + '\n'
+        yield json.dumps({'event': 'end', 'frames': frames}) + '\n'
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson')
+
+@app.route('/api/encode-all', methods=['POST'])
+def encode_all_faces():
+    """Lancer le ré-encodage de tous les visages des personnes existantes"""
+    try:
+        persons = store.list_persons()
+        started = encode_job.start(
+            persons, lambda person: capture_paths(person['image'])
+        )
         
-        # Sauvegarder les encodages
-        np.save(ENCODINGS_FILE, np.array(known_face_encodings, dtype=object))
-        np.save(NAMES_FILE, np.array(known_face_names, dtype=object))
+        if not started:
+            return jsonify({
+                'success': False,
+                'message': 'Un encodage est déjà en cours',
+                'data': encode_job.status()
+            }), 409
         
         return jsonify({
             'success': True,
-            'message': f'{len(known_face_names)} visages encodés avec succès'
-        })
+            'message': 'Encodage lancé',
+            'data': encode_job.status()
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/encode-all/status', methods=['GET'])
+def encode_all_status():
+    """Suivre la progression du ré-encodage"""
+    return jsonify({'success': True, 'data': encode_job.status()})
+
 # Routes pour les présences
 @app.route('/api/presences', methods=['GET'])
 def get_presences():
     """Récupérer toutes les présences"""
     try:
-        presences = load_json_file(PRESENCE_FILE)
-        
-        # Filtres optionnels
-        person_id = request.args.get('person_id')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        
-        filtered_presences = presences
-        
-        if person_id:
-            filtered_presences = [p for p in filtered_presences if p.get('person_id') == person_id]
-        
-        if date_from:
-            filtered_presences = [p for p in filtered_presences if p.get('date') >= date_from]
-        
-        if date_to:
-            filtered_presences = [p for p in filtered_presences if p.get('date') <= date_to]
-        
-        return jsonify({
+        # Les pointages du journal sont versés dans le stockage avant la lecture paginée
+        journal.compact()
+        
+        # Filtres optionnels (appliqués par des requêtes indexées)
+        filters = []
+        if request.args.get('person_id'):
+            filters.append(('person_id', '=', request.args['person_id']))
+        if request.args.get('date_from'):
+            filters.append(('date', '>=', request.args['date_from']))
+        if request.args.get('date_to'):
+            filters.append(('date', '<=', request.args['date_to']))
+        presences, next_cursor, total, etag = list_page('presences', PRESENCE_FIELDS, filters)
+        if presences is None:
+            return list_response(None, etag)
+        
+        return list_response({
             'success': True,
-            'data': filtered_presences,
-            'total': len(filtered_presences)
-        })
+            'data': presences,
+            'total': total,
+            'next_cursor': next_cursor
+        }, etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
     
@@ -338,26 +790,28 @@ def get_presences():
 def get_person_presences(person_id):
     """Récupérer les présences d'une personne"""
     try:
-        presences = load_json_file(PRESENCE_FILE)
-        persons = load_json_file(PERSONS_FILE)
-        
         # Trouver la personne
-        person = next((p for p in persons if p['id'] == person_id), None)
+        person = store.get_person(person_id)
         if not person:
             return jsonify({'success': False, 'message': 'Personne non trouvée'}), 404
         
-        # Filtrer les présences pour cette personne
-        person_presences = [p for p in presences if p.get('person_id') == person_id]
-        
-        # Trier par date décroissante
-        person_presences.sort(key=lambda x: x.get('date', ''), reverse=True)
+        # Présences de cette personne, par date décroissante
+        journal.compact()
+        person_presences, next_cursor, total, etag = list_page(
+            'presences', PRESENCE_FIELDS, [('person_id', '=', person_id)],
+            default_sort='date', default_descending=True, etag_extra=store.table_version('persons'))
+        if person_presences is None:
+            return list_response(None, etag)
         
-        return jsonify({
+        return list_response({
             'success': True,
             'person': person,
             'presences': person_presences,
-            'total': len(person_presences)
-        })
+            'total': total,
+            'next_cursor': next_cursor
+        }, etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -375,8 +829,6 @@ def add_presence():
                     'message': f'Le champ {field} est requis'
                 }), 400
         
-        presences = load_json_file(PRESENCE_FILE)
-        
         # Créer une nouvelle présence
         new_presence = {
             'id': str(uuid.uuid4()),
@@ -388,30 +840,17 @@ def add_presence():
         }
         
         # Vérifier si la personne est déjà présente aujourd'hui
-        today = new_presence['date']
-        existing_presence = next((p for p in presences 
-                                if p['person_id'] == data['person_id'] 
-                                and p['date'] == today), None)
-        
-        if existing_presence:
+        if not journal.add(new_presence):
             return jsonify({
                 'success': False, 
                 'message': 'Présence déjà enregistrée pour aujourd\'hui'
             }), 400
         
-        presences.append(new_presence)
-        
-        if save_json_file(PRESENCE_FILE, presences):
-            return jsonify({
-                'success': True, 
-                'message': 'Présence enregistrée avec succès',
-                'data': new_presence
-            }), 201
-        else:
-            return jsonify({
-                'success': False, 
-                'message': 'Erreur lors de la sauvegarde'
-            }), 500
+        return jsonify({
+            'success': True, 
+            'message': 'Présence enregistrée avec succès',
+            'data': new_presence
+        }), 201
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -419,27 +858,21 @@ def add_presence():
 # Routes pour les recherches
 @app.route('/api/search/persons', methods=['GET'])
 def search_persons():
-    """Rechercher des personnes"""
+    """Rechercher des personnes (nom, email, poste, département), les plus pertinentes d'abord"""
     try:
-        query = request.args.get('q', '').lower()
-        persons = load_json_file(PERSONS_FILE)
+        query = request.args.get('q', '')
         
-        if not query:
-            return jsonify({'success': True, 'data': persons})
+        if not query.strip():
+            return jsonify({'success': True, 'data': store.list_persons()})
         
-        # Recherche dans nom, email, poste, département
-        filtered_persons = []
-        for person in persons:
-            if (query in person.get('nom', '').lower() or 
-                query in person.get('email', '').lower() or 
-                query in person.get('poste', '').lower() or 
-                query in person.get('departement', '').lower()):
-                filtered_persons.append(person)
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        search_index.refresh()
+        results = search_index.search(query, limit=limit)
         
         return jsonify({
             'success': True,
-            'data': filtered_persons,
-            'total': len(filtered_persons)
+            'data': results,
+            'total': len(results)
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -447,107 +880,120 @@ def search_persons():
 # Route pour les statistiques
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """Récupérer les statistiques du système"""
+    """Récupérer les statistiques du système.
+
+    Options: from/to (AAAA-MM-JJ) pour les présences par jour d'une période,
+    group_by=departement, hourly=1 pour l'histogramme par heure, person_id
+    pour le résumé d'une personne.
+    """
     try:
-        persons = load_json_file(PERSONS_FILE)
-        presences = load_json_file(PRESENCE_FILE)
+        from datetime import timedelta
         
         # Statistiques de base
-        total_persons = len(persons)
-        active_persons = len([p for p in persons if p.get('active', True)])
+        total_persons = store.count_persons()
+        active_persons = store.count_persons(active_only=True)
         
-        # Présences d'aujourd'hui
+        # Présences d'aujourd'hui et de cette semaine, depuis les agrégats
         today = datetime.now().strftime('%Y-%m-%d')
-        today_presences = len([p for p in presences if p.get('date') == today])
-        
-        # Présences de cette semaine
-        from datetime import timedelta
         week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        week_presences = len([p for p in presences if p.get('date') >= week_ago])
+        pending = journal.pending(date_from=week_ago)
+        week = store.attendance_stats(week_ago, today, extra=pending)
+        today_presences = sum(day['count'] for day in week['days'] if day['date'] == today)
+        
+        data = {
+            'total_persons': total_persons,
+            'active_persons': active_persons,
+            'today_presences': today_presences,
+            'week_presences': week['total'],
+            'total_presences': store.count_presences() + len(journal.pending())
+        }
         
-        return jsonify({
-            'success': True,
-            'data': {
-                'total_persons': total_persons,
-                'active_persons': active_persons,
-                'today_presences': today_presences,
-                'week_presences': week_presences,
-                'total_presences': len(presences)
-            }
-        })
+        date_from = request.args.get('from')
+        date_to = request.args.get('to', today)
+        group_by_departement = request.args.get('group_by') == 'departement'
+        hourly = request.args.get('hourly') in ('1', 'true')
+        if date_from or group_by_departement or hourly:
+            date_from = date_from or today
+            data['range'] = store.attendance_stats(
+                date_from, date_to, group_by_departement=group_by_departement, hourly=hourly,
+                extra=journal.pending(date_from=date_from, date_to=date_to))
+            data['range'].update({'from': date_from, 'to': date_to})
+        
+        if request.args.get('person_id'):
+            person_id = request.args['person_id']
+            person = store.person_stats(person_id)
+            for presence in journal.pending(person_id=person_id):
+                person['count'] += 1
+                person['last_date'] = max(person.get('last_date') or '', presence['date'])
+            data['person'] = person
+        
+        return jsonify({'success': True, 'data': data})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Route pour uploader des images
 @app.route('/api/upload/image', methods=['POST'])
 def upload_image():
-    """Upload d'image et encodage du visage"""
+    """Upload d'une ou plusieurs captures d'un visage et encodage.
+
+    Plusieurs captures de la même personne ('images') donnent plusieurs
+    modèles en galerie; chaque capture est notée (taille, netteté, pose) et
+    refusée si sa qualité est insuffisante. 'person_id' (optionnel) désigne
+    la personne existante à qui les captures sont destinées.
+    """
     try:
-        if 'image' not in request.files:
+        files = request.files.getlist('image') + request.files.getlist('images')
+        if not files:
             return jsonify({'success': False, 'message': 'Aucune image fournie'}), 400
         
-        file = request.files['image']
-        if file.filename == '':
+        if any(file.filename == '' for file in files):
             return jsonify({'success': False, 'message': 'Aucun fichier sélectionné'}), 400
         
-        # Vérification de l'extension
-        if '.' not in file.filename:
-            return jsonify({'success': False, 'message': 'Extension de fichier manquante'}), 400
-            
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        if file_extension not in ['jpg', 'jpeg', 'png']:
-            return jsonify({'success': False, 'message': 'Format d\'image non supporté'}), 400
-        
-        # Génération d'un nom de fichier unique
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # Sauvegarde temporaire pour le traitement
-        file.save(filepath)
-        
-        # Chargement et encodage du visage
-        image = face_recognition.load_image_file(filepath)
-        face_locations = face_recognition.face_locations(image)
-        
-        if not face_locations:
-            os.remove(filepath)
-            return jsonify({
-                'success': False,
-                'message': 'Aucun visage détecté dans l\'image'
-            }), 400
+        if len(files) > MAX_CAPTURES:
+            return jsonify({'success': False, 'message': f'{MAX_CAPTURES} captures au maximum'}), 400
         
-        # Encodage du premier visage détecté
-        face_encoding = face_recognition.face_encodings(image, [face_locations[0]])[0]
-        
-        # Chargement des encodages existants
-        known_face_encodings = np.load(ENCODINGS_FILE, allow_pickle=True).tolist()
-        known_face_names = np.load(NAMES_FILE, allow_pickle=True).tolist()
+        # Vérification de l'extension
+        extensions = []
+        for file in files:
+            if '.' not in file.filename:
+                return jsonify({'success': False, 'message': 'Extension de fichier manquante'}), 400
+            extensions.append(file.filename.rsplit('.', 1)[1].lower())
+            if extensions[-1] not in ['jpg', 'jpeg', 'png']:
+                return jsonify({'success': False, 'message': 'Format d\'image non supporté'}), 400
+        
+        person_id = request.form.get('person_id') or None
+        if person_id and not store.get_person(person_id):
+            return jsonify({'success': False, 'message': 'Personne non trouvée'}), 404
         
-        # Vérification si l'encodage existe déjà
-        if known_face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            if True in matches:
-                os.remove(filepath)
-                return jsonify({
-                    'success': False,
-                    'message': 'Ce visage est déjà enregistré dans le système'
-                }), 400
+        # Génération d'un nom de fichier unique (image principale; les captures suivantes en dérivent)
+        filename = f"{uuid.uuid4()}.{extensions[0]}"
         
-        # Sauvegarde des nouveaux encodages
-        known_face_encodings.append(face_encoding)
-        np.save(ENCODINGS_FILE, np.array(known_face_encodings, dtype=object))
+        # Détection, qualité, encodage et contrôle des doublons sont faits par la file d'enrôlement
+        detection = request_detection('enroll')
+        job_ids = [enrollment_queue.submit(file.read(), filename, detection, person_id) for file in files]
         
         return jsonify({
             'success': True,
-            'message': 'Image uploadée et visage encodé avec succès',
+            'message': 'Image reçue, enrôlement en cours' if len(files) == 1 else f'{len(files)} captures reçues, enrôlement en cours',
+            'job_id': job_ids[0],
+            'job_ids': job_ids,
             'filename': filename,
-            'path': f'/uploads/images/{filename}'
-        })
+            'path': f'/uploads/images/{filename}',
+            'status_url': f'/api/upload/jobs/{job_ids[0]}'
+        }), 202
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
         return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    """Suivre l'enrôlement d'une image uploadée"""
+    job = enrollment_queue.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Tâche non trouvée'}), 404
+    return jsonify({'success': True, 'data': job})
     
 # Route pour servir les images
 @app.route('/uploads/images/<filename>')
@@ -562,12 +1008,23 @@ def serve_image(filename):
 def get_absents():
     """Récupérer la liste des personnes absentes"""
     try:
-        absents = load_json_file(ABSENT_FILE)
-        return jsonify({
+        # Journée du jour par défaut; les présences du journal sont versées avant la lecture
+        today = datetime.now().strftime('%Y-%m-%d')
+        date = request.args.get('date') or today
+        if date == today:
+            store.open_absence_day(today)
+            journal.compact()
+        absents, next_cursor, total, etag = list_page('absents', ABSENT_FIELDS, [('date', '=', date)])
+        if absents is None:
+            return list_response(None, etag)
+        return list_response({
             'success': True,
             'data': absents,
-            'total': len(absents)
-        })
+            'total': total,
+            'next_cursor': next_cursor
+        }, etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 @app.route('/api/absent/<person_id>', methods=['PUT'])
@@ -575,28 +1032,52 @@ def update_absent_reason(person_id):
     """Mettre à jour la raison d'absence d'une personne"""
     try:
         data = request.get_json()
-        absents = load_json_file(ABSENT_FILE)
         
-        # Trouver l'absence à mettre à jour
-        for absent in absents:
-            if absent['id'] == person_id:
-                absent['raison'] = data.get('raison', '')
-                break
+        # Mettre à jour l'absence de cette personne
+        store.update_absent_reason(person_id, data.get('raison', ''), date=data.get('date'))
         
-        if save_json_file(ABSENT_FILE, absents):
-            return jsonify({
-                'success': True, 
-                'message': 'Raison mise à jour avec succès'
-            })
-        else:
-            return jsonify({
-                'success': False, 
-                'message': 'Erreur lors de la sauvegarde'
-            }), 500
+        return jsonify({
+            'success': True, 
+            'message': 'Raison mise à jour avec succès'
+        })
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def warm_up():
+    """Démarrer le pool de reconnaissance avant de recevoir du trafic.
+
+    Appelé au démarrage si WARMUP=1 (app.run) ou par le hook post_worker_init
+    de gunicorn.conf.py. Chaque processus du pool charge la galerie et, avec
+    WARMUP=1, les modèles dlib (voir recognition_service._init_worker); le
+    worker web ne lit que la galerie et l'index de recherche.
+    """
+    start = time.perf_counter()
+    processes = recognition.start()
+    gallery.refresh()
+    search_index.refresh()
+    print(f"🔥 Préchauffage terminé en {time.perf_counter() - start:.1f} s "
+          f"({processes} processus de reconnaissance, {len(gallery)} visage(s) en galerie)")
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """État du worker: la pile de vision est-elle déjà chargée ?"""
+    return jsonify({
+        'success': True,
+        'vision_loaded': recognition.metrics()['started'],
+        'gallery_faces': len(gallery),
+        'recognition': recognition.metrics()
+    })
+
+@app.route('/api/recognize/metrics', methods=['GET'])
+def recognition_metrics():
+    """Profondeur de file, rejets, délais dépassés et latence du pool de reconnaissance"""
+    return jsonify({'success': True, 'data': recognition.metrics()})
+
+
 if __name__ == '__main__':
+    init()
+    if os.environ.get('WARMUP') == '1':
+        warm_up()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import csv
+import os
+import queue
+import threading
+from datetime import datetime
+
+
+class AttendanceWriter:
+    """Enregistrement des pointages du kiosque sans bloquer la caméra.
+
+    Les personnes déjà pointées aujourd'hui sont gardées en mémoire, par
+    identifiant (le nom seulement pour une personne sans identifiant): le
+    contrôle des doublons ne lit aucun fichier. Les pointages sont mis en
+    file et écrits par lots par un thread de fond (ajout en fin de
+    rapport_presence.csv et dans le journal des présences); `close()` vide la
+    file avant l'arrêt.
+    """
+
+    CSV_HEADER = ['Nom', 'Date', 'Heure']
+
+    def __init__(self, csv_file, journal, interval=1.0, batch_size=100):
+        self.csv_file = csv_file
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._day = datetime.now().strftime('%Y-%m-%d')
+        self._marked = self._load_marked(self._day)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _load_marked(self, day):
+        """Personnes déjà pointées ce jour dans le stockage et le journal (lu une seule fois, au démarrage)"""
+        marked = set()
+        try:
+            presences = self.journal.store.list_presences(date_from=day, date_to=day)
+            presences += self.journal.pending(date_from=day, date_to=day)
+        except Exception as e:
+            print(f"Erreur lors de la lecture des présences du jour: {e}")
+            return marked
+        for presence in presences:
+            marked.add(self._key(presence.get('nom'), presence.get('person_id')))
+        return marked
+
+    @staticmethod
+    def _key(name, person_id):
+        # Deux homonymes sont deux personnes: le nom ne sert qu'à défaut d'identifiant
+        return ('id', person_id) if person_id else ('nom', name)
+
+    def mark(self, name, person_id='', image=''):
+        """Pointer une personne; renvoie False si elle l'est déjà aujourd'hui (aucune E/S ici)"""
+        now = datetime.now()
+        date_today = now.strftime('%Y-%m-%d')
+        with self._lock:
+            if date_today != self._day:
+                self._day = date_today
+                self._marked = set()
+            key = self._key(name, person_id)
+            if key in self._marked:
+                return False
+            self._marked.add(key)
+        self._queue.put({
+            'nom': name,
+            'date': date_today,
+            'heure': now.strftime('%H:%M:%S'),
+            'image': image,
+            'person_id': person_id,
+        })
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Écrire les pointages en attente par lots"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Erreur lors de l'enregistrement des présences: {e}")
+
+    def _write(self, batch):
+        new_file = not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0
+        with open(self.csv_file, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(self.CSV_HEADER)
+            writer.writerows([p['nom'], p['date'], p['heure']] for p in batch)
+        for presence in batch:
+            self.journal.add(presence)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
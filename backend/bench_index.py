@@ -0,0 +1,91 @@
+"""Benchmark rappel / latence des index de visages (flat exact contre IVF approché).
+
+Usage: python bench_index.py [--size 50000] [--queries 500] [--k 1]
+
+Les encodages sont synthétiques mais ont l'écart des encodages dlib : deux
+photos d'une même personne sont à ~0.4 l'une de l'autre, deux personnes
+différentes à ~0.8 (seuil de reconnaissance 0.6). Les nuages des identités
+se recouvrent donc autant qu'en vrai. Chaque requête est une nouvelle photo
+(nouveau bruit) d'une personne de la galerie; le rappel@k de l'IVF est
+mesuré contre les k voisins exacts de l'index flat, pour chaque nprobe.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from face_index import FlatIndex, IVFIndex
+
+
+# Écarts-types par dimension: intra = sqrt(2 * 128) * PHOTO_SIGMA ~ 0.4,
+# inter = sqrt(2 * 128 * (PERSON_SIGMA² + PHOTO_SIGMA²)) ~ 0.8
+PERSON_SIGMA = 0.0433
+PHOTO_SIGMA = 0.025
+
+
+def synthetic_people(count, dim=128, seed=0):
+    """Centres des identités (le visage « moyen » de chaque personne)"""
+    return np.random.default_rng(seed).normal(0.0, PERSON_SIGMA, size=(count, dim)).astype(np.float32)
+
+
+def photos(people, labels, rng):
+    """Une photo (encodage bruité) de la personne labels[i] pour chaque i"""
+    return people[labels] + rng.normal(0.0, PHOTO_SIGMA, size=(len(labels), people.shape[1])).astype(np.float32)
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    results = [index.search(q, k)[0] for q in queries]
+    elapsed = time.perf_counter() - start
+    return results, elapsed * 1000.0 / len(queries)
+
+
+def recall(results, truth, k):
+    hits = 0
+    for (ids, _), (true_ids, _) in zip(results, truth):
+        hits += len(set(ids[:k].tolist()) & set(true_ids[:k].tolist()))
+    return hits / (len(truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=1)
+    parser.add_argument('--templates', type=int, default=3, help="photos par personne dans la galerie")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    people = synthetic_people(max(1, args.size // args.templates))
+    labels = np.arange(args.size) % len(people)
+    gallery = photos(people, labels, rng)
+    queries = photos(people, rng.choice(labels, args.queries), rng)
+    same = np.linalg.norm(gallery[:len(people)] - photos(people, labels[:len(people)], rng), axis=1).mean()
+    other = np.linalg.norm(gallery[:len(people) - 1] - gallery[1:len(people)], axis=1).mean()
+    print(f"distance moyenne: même personne {same:.2f}, personnes différentes {other:.2f}")
+
+    flat = FlatIndex()
+    flat.build(gallery)
+    truth, flat_ms = timed_search(flat, queries, args.k)
+    print(f"{'index':<18}{'build (s)':>10}{'rappel@' + str(args.k):>12}{'ms/requête':>12}")
+    print(f"{'flat':<18}{'-':>10}{1.0:>12.3f}{flat_ms:>12.3f}")
+
+    start = time.perf_counter()
+    ivf = IVFIndex()
+    ivf.build(gallery)
+    build_s = time.perf_counter() - start
+    for nprobe in (1, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        results, ms = timed_search(ivf, queries, args.k)
+        print(f"{'ivf nprobe=' + str(nprobe):<18}{build_s:>10.2f}{recall(results, truth, args.k):>12.3f}{ms:>12.3f}")
+
+    # Ajout incrémental : 1% de la galerie ajouté après coup, sans ré-entraînement
+    extra = photos(people, rng.choice(labels, max(1, args.size // 100)), rng)
+    start = time.perf_counter()
+    for row in extra:
+        ivf.add(row)
+    print(f"ajout incrémental: {(time.perf_counter() - start) * 1000.0 / len(extra):.3f} ms/encodage")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+FrameResult = namedtuple('FrameResult', ['frame_id', 'captured_at', 'frame', 'output'])
+
+
+class LatencyStats:
+    """Latence par étape du pipeline (moyenne glissante et maximum, en millisecondes)"""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000.0
+        with self._lock:
+            stat = self._stages.setdefault(stage, {'count': 0, 'avg_ms': ms, 'max_ms': ms})
+            stat['count'] += 1
+            stat['avg_ms'] += self.alpha * (ms - stat['avg_ms'])
+            stat['max_ms'] = max(stat['max_ms'], ms)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: dict(stat, avg_ms=round(stat['avg_ms'], 1), max_ms=round(stat['max_ms'], 1))
+                      for name, stat in self._stages.items()}
+            return {'stages': stages, 'counters': dict(self._counters)}
+
+
+def put_latest(q, item):
+    """Déposer dans une file bornée en jetant l'élément le plus ancien si elle est pleine"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return 0
+        except queue.Full:
+            try:
+                q.get_nowait()
+                return 1
+            except queue.Empty:
+                pass
+
+
+class FramePipeline:
+    """Pipeline caméra à étages: capture, traitement (pool de threads), affichage.
+
+    Le thread de capture lit la caméra en continu et ne garde que les images
+    les plus récentes (file bornée, les plus anciennes sont jetées). Les
+    workers appliquent `process(frame_id, frame, record)` (détection,
+    encodage, comparaison) et ignorent les images trop vieilles; le numéro
+    d'image permet à `process` d'appliquer les résultats dans l'ordre. L'affichage récupère
+    le dernier résultat avec `latest()`; il n'attend donc jamais la détection.
+    """
+
+    def __init__(self, source, process, workers=2, queue_size=2, max_frame_age=0.5):
+        self.source = source
+        self.process = process
+        self.workers = workers
+        self.max_frame_age = max_frame_age
+        self.stats = LatencyStats()
+        self.finished = threading.Event()
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_frame_id = -1
+        self._capture = None
+
+    def start(self):
+        self._capture = cv2.VideoCapture(self.source)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Source vidéo inaccessible: {self.source}")
+        # Pas de file d'attente côté pilote: on veut toujours l'image la plus récente
+        self._capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._threads = [threading.Thread(target=self._capture_loop, daemon=True)]
+        self._threads += [threading.Thread(target=self._worker_loop, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def _capture_loop(self):
+        frame_id = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            ret, frame = self._capture.read()
+            if not ret:
+                print(f"❌ Fin ou erreur de la source vidéo {self.source}")
+                break
+            self.stats.record('capture', time.perf_counter() - start)
+            dropped = put_latest(self._frames, (frame_id, time.monotonic(), frame))
+            if dropped:
+                self.stats.count('dropped_queue', dropped)
+            frame_id += 1
+        self.finished.set()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                frame_id, captured_at, frame = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                if self.finished.is_set():
+                    break
+                continue
+            wait = time.monotonic() - captured_at
+            self.stats.record('queue', wait)
+            if wait > self.max_frame_age:
+                self.stats.count('dropped_stale')
+                continue
+            start = time.perf_counter()
+            try:
+                output = self.process(frame_id, frame, self.stats.record)
+            except Exception as e:
+                print(f"❌ Erreur de reconnaissance: {str(e)}")
+                continue
+            self.stats.record('process', time.perf_counter() - start)
+            put_latest(self._results, FrameResult(frame_id, captured_at, frame, output))
+
+    def latest(self, timeout=0.05):
+        """Dernier résultat plus récent que celui déjà affiché, sinon None"""
+        result = None
+        try:
+            result = self._results.get(timeout=timeout)
+            while True:
+                result = self._results.get_nowait()
+        except queue.Empty:
+            pass
+        if result is None or result.frame_id <= self._last_frame_id:
+            return None
+        self._last_frame_id = result.frame_id
+        self.stats.record('end_to_end', time.monotonic() - result.captured_at)
+        return result
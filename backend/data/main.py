@@ -1,10 +1,7 @@
 import cv2
 import os
-import face_recognition
-import numpy as np
-import pandas as pd
-import json
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta
 from tkinter import (
     BooleanVar, Checkbutton, Tk, Button, Label, Entry, Toplevel, Text, Scrollbar, Frame,
     VERTICAL, RIGHT, LEFT, Y, BOTH, END
@@ -14,104 +11,76 @@ from playsound import playsound
 import time
 import uuid
 
+# Modules partagés avec l'API (dossier backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery import MAX_TEMPLATES, FaceGallery, convert_legacy, person_templates, remove_persons, set_person_encodings
+from face_quality import face_quality
+from store import Store
+from journal import PresenceJournal
+from attendance_writer import AttendanceWriter
+from encoding_cache import detect_and_encode
+from camera_pipeline import FramePipeline
+from face_tracker import FaceTracker
+from face_detection import env_detection_params
+from recognition_server import VIDEO_DETECTION, detect_faces, identify_faces
+
 class FaceRecognitionSystem:
     def __init__(self):
         self.database_path = "../../frontend/public"
         self.encodings_file = "encodings.npy"
         self.names_file = "names.npy"
+        self.gallery_file = "gallery.bin"
         self.attendance_file = "rapport_presence.csv"
         self.presence_json_file = "presence.json"
         self.person_file = "personnes.json"
-        self.known_face_encodings = []
-        self.known_face_names = []
+        self.absent_file = "absent.json"
+        self.store = Store("pointage.db")
+        self.store.migrate_from_json(self.person_file, self.presence_json_file, self.absent_file)
+        self.journal = PresenceJournal(self.store, "journal", name="kiosk")
+        self.journal.start()
+        # Rapport CSV et journal écrits par lots en arrière-plan
+        self.attendance = AttendanceWriter(self.attendance_file, self.journal)
+        self.pipeline_workers = int(os.environ.get("PIPELINE_WORKERS", 2))
+        # Échelle de détection (0.25 par défaut); le suivi permet de monter la résolution
+        self.frame_scale = float(os.environ.get("FRAME_SCALE", 0.25))
+        self.redetect_every = int(os.environ.get("REDETECT_EVERY", 10))
+        # Détecteur (FACE_DETECTOR), suréchantillonnage (FACE_UPSAMPLE) et échelles (DETECTION_LADDER)
+        self.detection = env_detection_params(VIDEO_DETECTION)
+        self.tracker = None
         self.persons = []
+        self.gallery = FaceGallery(self.gallery_file, tolerance=0.6,
+                                   index=os.environ.get("GALLERY_INDEX", "flat"))
         self.load_encodings()
         self.load_persons()
 
     def generer_absents(self):
+        """Ouvrir la journée d'absences (une seule fois par jour); les présences la mettent ensuite à jour"""
         date_aujourdhui = datetime.now().strftime("%Y-%m-%d")
-
-        if not os.path.exists(self.person_file):
-            print("⚠️ Fichier personnes introuvable.")
-            return
-
-        with open(self.person_file, "r", encoding="utf-8") as f:
-            personnes = json.load(f)
-
-        presences = []
-        if os.path.exists(self.presence_json_file):
-            with open(self.presence_json_file, "r", encoding="utf-8") as f:
-                toutes_presences = json.load(f)
-                presences = [p for p in toutes_presences if p["date"] == date_aujourdhui]
-
-        noms_presents = {p["nom"] for p in presences}
-
-        absents = []
-        for person in personnes:
-            if person.get("active", True) and person["nom"] not in noms_presents:
-                absents.append({
-                    "id": person["id"],
-                    "nom": person["nom"],
-                    "email": person["email"],
-                    "telephone": person["telephone"],
-                    "image": person["image"],
-                    "poste": person["poste"],
-                    "departement": person["departement"],
-                    "date": date_aujourdhui
-                })
-
-        with open("absent.json", "w", encoding="utf-8") as f:
-            json.dump(absents, f, indent=4, ensure_ascii=False)
-
-        print(f"✅ Fichier 'absent.json' généré avec {len(absents)} absent(s).")
+        # Les pointages encore dans le journal retirent leurs absents en arrivant dans le stockage
+        self.journal.compact()
+        nb_absents = self.store.open_absence_day(date_aujourdhui)
+        print(f"✅ Liste des absents: {nb_absents} absent(s).")
 
     def load_encodings(self):
         try:
-            if os.path.exists(self.encodings_file) and os.path.exists(self.names_file):
-                encodings = np.load(self.encodings_file, allow_pickle=True)
-                names = np.load(self.names_file, allow_pickle=True)
-                
-                if len(encodings) > 0 and isinstance(encodings[0], np.ndarray):
-                    self.known_face_encodings = list(encodings)
-                    self.known_face_names = list(names)
-                else:
-                    print("⚠️ Invalid encodings data - resetting")
-                    self.known_face_encodings = []
-                    self.known_face_names = []
-                    self.save_encodings()
+            if (not os.path.exists(self.gallery_file) and os.path.exists(self.encodings_file)
+                    and os.path.exists(self.names_file)):
+                convert_legacy(self.encodings_file, self.names_file, self.store.list_persons(), self.gallery_file)
+            self.gallery.refresh()
         except Exception as e:
             print(f"Error loading encodings: {e}")
-            self.known_face_encodings = []
-            self.known_face_names = []
-
-    def save_encodings(self):
-        try:
-            encodings_array = np.array(self.known_face_encodings, dtype=np.float64)
-            names_array = np.array(self.known_face_names, dtype=object)
-            
-            np.save(self.encodings_file, encodings_array)
-            np.save(self.names_file, names_array)
-        except Exception as e:
-            print(f"Error saving encodings: {e}")
 
     def load_persons(self):
-        if os.path.exists(self.person_file):
-            with open(self.person_file, "r", encoding="utf-8") as f:
-                self.persons = json.load(f)
-        else:
-            self.persons = []
-
-    def save_persons(self):
-        with open(self.person_file, "w", encoding="utf-8") as f:
-            json.dump(self.persons, f, indent=4, ensure_ascii=False)
+        self.persons = self.store.list_persons()
 
     def add_person(self, name, email, phone, poste, dep, active):
         if not os.path.exists(self.database_path):
             os.makedirs(self.database_path)
 
         cap = cv2.VideoCapture(0)
-        print("📸 Placez la personne devant la caméra. Appuyez sur 'c' pour capturer, 'q' pour annuler.")
-        img_path = None
+        print("📸 Placez la personne devant la caméra. Appuyez sur 'c' pour capturer (plusieurs angles possibles), "
+              "'v' pour valider, 'q' pour annuler.")
+        captures = []   # (score de qualité, encodage, chemin de l'image)
 
         while True:
             ret, frame = cap.read()
@@ -123,33 +92,36 @@ class FaceRecognitionSystem:
             key = cv2.waitKey(1) & 0xFF
 
             if key == ord('c'):
+                capture = self.score_capture(frame)
+                if capture is None:
+                    continue
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"{name}_{timestamp}.jpg"
-                img_path = os.path.join(self.database_path, filename)
+                img_path = os.path.join(self.database_path, f"{name}_{timestamp}_{len(captures) + 1}.jpg")
                 cv2.imwrite(img_path, frame)
-                print(f"✅ {name} ajouté avec succès ! Image sauvegardée à {img_path}")
+                captures.append(capture + (img_path,))
+                print(f"✅ Capture {len(captures)} acceptée (qualité {capture[0]:.2f}), image sauvegardée à {img_path}")
+                if len(captures) >= MAX_TEMPLATES:
+                    break
+            elif key == ord('v') and captures:
                 break
             elif key == ord('q'):
+                for _, _, img_path in captures:
+                    os.remove(img_path)
+                captures = []
                 print("Ajout annulé.")
                 break
 
         cap.release()
         cv2.destroyAllWindows()
 
-        if img_path:
-            image = face_recognition.load_image_file(img_path)
-            face_locations = face_recognition.face_locations(image)
-            if not face_locations:
-                print("❌ Aucun visage détecté.")
-                return
-            face_encoding = face_recognition.face_encodings(image, known_face_locations=face_locations)[0]
-            self.known_face_encodings.append(face_encoding)
-            self.known_face_names.append(name)
-            self.save_encodings()
-
+        if captures:
+            # Les meilleures captures d'abord: ce sont elles qui sont gardées comme modèles
+            captures.sort(key=lambda capture: -capture[0])
+            img_path = captures[0][2]
             person_id = str(uuid.uuid4())
+
             now = datetime.now().isoformat()
-            self.persons.append({
+            person = {
                 "id": person_id,
                 "nom": name,
                 "email": email,
@@ -160,17 +132,40 @@ class FaceRecognitionSystem:
                 "date_creation": now,
                 "date_modification": now,
                 "active": active 
-            })
-            self.save_persons()
+            }
+            # Personne et modèles sont ajoutés ensemble
+            self.store.add_person(person)
+            try:
+                set_person_encodings(self.gallery_file, person_id, name,
+                                     person_templates([encoding for _, encoding, _ in captures]))
+            except Exception as e:
+                self.store.delete_person(person_id)
+                print(f"Error saving encodings: {e}")
+                return
+            self.persons.append(person)
+
+    def score_capture(self, frame):
+        """Encoder une capture de la caméra et noter sa qualité: (score, encodage) ou None si refusée"""
+        ok, buffer = cv2.imencode(".jpg", frame)
+        if not ok:
+            return None
+        _, face_locations, face_encodings, _ = detect_and_encode(buffer.tobytes())
+        if not face_locations:
+            print("❌ Aucun visage détecté.")
+            return None
+        quality = face_quality(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), face_locations[0])
+        if not quality['accepted']:
+            print(f"❌ Capture refusée: {', '.join(quality['reasons'])}")
+            return None
+        return quality['score'], face_encodings[0]
 
     def supprimer_personne(self, name_to_delete):
-        if name_to_delete in self.known_face_names:
-            index = self.known_face_names.index(name_to_delete)
-            self.known_face_names.pop(index)
-            self.known_face_encodings.pop(index)
-            self.save_encodings()
-            self.persons = [p for p in self.persons if p["nom"] != name_to_delete]
-            self.save_persons()
+        person_ids = [p["id"] for p in self.store.list_persons() if p["nom"] == name_to_delete]
+        if person_ids:
+            remove_persons(self.gallery_file, person_ids)
+            for person_id in person_ids:
+                self.store.delete_person(person_id)
+            self.persons = [p for p in self.persons if p["id"] not in person_ids]
 
             for f in os.listdir(self.database_path):
                 if f.startswith(name_to_delete + "_"):
@@ -182,144 +177,105 @@ class FaceRecognitionSystem:
         else:
             return False
 
-    def save_presence_json(self, name, date_today, time_now):
-        if os.path.exists(self.presence_json_file):
-            with open(self.presence_json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            data = []
-
-        if not any(p["nom"] == name and p["date"] == date_today for p in data):
-            image_path = ""
-            person_id = ""
-            for person in self.persons:
-                if person["nom"] == name:
-                    image_path = person.get("image", "")
-                    person_id = person.get("id", "")
-                    break
-            data.append({
-                "nom": name,
-                "date": date_today,
-                "heure": time_now,
-                "image": image_path,
-                "person_id": person_id
-            })
-            with open(self.presence_json_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-
-    def mark_attendance(self, name):
-        date_today = datetime.now().strftime("%Y-%m-%d")
-        time_now = datetime.now().strftime("%H:%M:%S")
-
-        if not os.path.exists(self.attendance_file):
-            df = pd.DataFrame(columns=["Nom", "Date", "Heure"])
-        else:
-            df = pd.read_csv(self.attendance_file)
+    def mark_attendance(self, name, person_id):
+        """Pointer une personne: aucune lecture ni écriture de fichier sur le thread de la caméra.
+
+        `person_id` vient de la galerie (piste du tracker): une personne
+        enrôlée après le démarrage est pointée sous son identifiant même si
+        `self.persons` ne la connaît pas encore.
+        """
+        image_path = ""
+        for person in self.persons:
+            if person.get("id") == person_id:
+                image_path = person.get("image", "")
+                break
 
-        if not ((df['Nom'] == name) & (df['Date'] == date_today)).any():
-            new_row = {"Nom": name, "Date": date_today, "Heure": time_now}
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            df.to_csv(self.attendance_file, index=False)
+        self.attendance.mark(name, person_id=person_id or "", image=image_path)
 
-        self.save_presence_json(name, date_today, time_now)
+    def identify_faces(self, rgb_frame, face_locations):
+        return identify_faces(self.gallery, rgb_frame, face_locations)
+
+    def process_frame(self, frame_id, frame, record):
+        """Suivi, détection et identification d'une image (exécuté par les workers du pipeline)"""
+        start = time.perf_counter()
+        small_frame = cv2.resize(frame, (0, 0), fx=self.frame_scale, fy=self.frame_scale)
+        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+        record("resize", time.perf_counter() - start)
+
+        # Détection et encodage en parallèle; le tracker applique les images dans l'ordre de capture
+        tracks = self.tracker.update(rgb_small_frame, record, seq=frame_id)
+        return [([int(v / self.frame_scale) for v in track.box], track.name, track.person_id) for track in tracks]
 
     def start_recognition(self):
         self.load_encodings()
+        self.gallery.refresh()
         print("🎥 Démarrage de la reconnaissance. Appuyez sur 'q' pour quitter.")
 
-        if not self.known_face_encodings:
+        if not len(self.gallery):
             print("⚠️ Base vide.")
             return
 
-        video_capture = cv2.VideoCapture(0)
+        self.tracker = FaceTracker(lambda rgb: detect_faces(rgb, self.detection), self.identify_faces, redetect_every=self.redetect_every)
+        # Capture et détection tournent dans leurs propres threads; cette boucle ne fait qu'afficher
+        pipeline = FramePipeline(0, self.process_frame, workers=self.pipeline_workers).start()
         pause_until = None
         validated_name = ""
         paused_frame = None
+        last_stats = time.monotonic()
 
-        while True:
-            if pause_until:
-                if datetime.now() < pause_until:
-                    frame = paused_frame.copy()
-                    message = f" Validation : {validated_name}"
-                    (text_width, text_height), baseline = cv2.getTextSize(message, cv2.FONT_HERSHEY_DUPLEX, 1, 2)
-                    x, y = 30, 50
-                    cv2.rectangle(frame, (x-5, y - text_height - 5), (x + text_width + 5, y + baseline + 5), (0, 0, 0), cv2.FILLED)
-                    cv2.putText(frame, message, (x, y), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 255, 0), 2)
-                    cv2.imshow('Reconnaissance faciale', frame)
+        try:
+            while True:
+                if pause_until:
+                    if datetime.now() < pause_until:
+                        frame = paused_frame.copy()
+                        message = f" Validation : {validated_name}"
+                        (text_width, text_height), baseline = cv2.getTextSize(message, cv2.FONT_HERSHEY_DUPLEX, 1, 2)
+                        x, y = 30, 50
+                        cv2.rectangle(frame, (x-5, y - text_height - 5), (x + text_width + 5, y + baseline + 5), (0, 0, 0), cv2.FILLED)
+                        cv2.putText(frame, message, (x, y), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 255, 0), 2)
+                        cv2.imshow('Reconnaissance faciale', frame)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+                        continue
+                    else:
+                        pause_until = None
+                        paused_frame = None
+
+                result = pipeline.latest()
+                if result is None:
+                    if pipeline.finished.is_set():
+                        print("❌ Erreur caméra.")
+                        break
                     if cv2.waitKey(1) & 0xFF == ord('q'):
                         break
                     continue
-                else:
-                    pause_until = None
-                    paused_frame = None
 
-            ret, frame = video_capture.read()
-            if not ret:
-                print("❌ Erreur caméra.")
-                break
+                start = time.perf_counter()
+                frame = result.frame
+                for (top, right, bottom, left), name, person_id in result.output:
+                    if name != "Inconnu" and pause_until is None:
+                        self.mark_attendance(name, person_id)
+                        validated_name = name
+                        Thread(target=playsound, args=("success.mp3",), daemon=True).start()
+                        pause_until = datetime.now() + timedelta(seconds=10)
+                        paused_frame = frame.copy()
 
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_small_frame)
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                    cv2.putText(frame, name, (left, top - 10), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-            if not face_locations:
                 cv2.imshow('Reconnaissance faciale', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                continue
-
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, known_face_locations=face_locations)
-
-            for face_encoding, face_location in zip(face_encodings, face_locations):
-                matches = []
-                face_distances = []
-                name = "Inconnu"
-                
-                try:
-                    if not isinstance(face_encoding, np.ndarray) or face_encoding.shape != (128,):
-                        print("⚠️ Encodage facial invalide")
-                        continue
-                    
-                    if len(self.known_face_encodings) == 0:
-                        print("⚠️ Aucun visage connu chargé")
-                        continue
-
-                    matches = face_recognition.compare_faces(
-                        self.known_face_encodings, 
-                        face_encoding,
-                        tolerance=0.6
-                    )
-                    
-                    face_distances = face_recognition.face_distance(
-                        self.known_face_encodings, 
-                        face_encoding
-                    )
-
-                    if len(face_distances) > 0:
-                        best_match_index = np.argmin(face_distances)
-                        if matches[best_match_index]:
-                            name = self.known_face_names[best_match_index]
-                            self.mark_attendance(name)
-                            validated_name = name
-                            Thread(target=playsound, args=("success.mp3",), daemon=True).start()
-                            pause_until = datetime.now() + pd.Timedelta(seconds=10).to_pytimedelta()
-                            paused_frame = frame.copy()
-
-                except Exception as e:
-                    print(f"❌ Erreur de reconnaissance: {str(e)}")
-                    continue
+                pipeline.stats.record("display", time.perf_counter() - start)
 
-                top, right, bottom, left = [v * 4 for v in face_location]
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                cv2.putText(frame, name, (left, top - 10), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                if time.monotonic() - last_stats > 30:
+                    print(f"⏱️ Latences du pipeline: {pipeline.stats.snapshot()}")
+                    last_stats = time.monotonic()
 
-            cv2.imshow('Reconnaissance faciale', frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-
-        video_capture.release()
-        cv2.destroyAllWindows()
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        finally:
+            pipeline.stop()
+            cv2.destroyAllWindows()
 
 class App:
     def __init__(self, root):
@@ -422,9 +378,8 @@ class App:
         scrollbar.pack(side=RIGHT, fill=Y)
         text.config(yscrollcommand=scrollbar.set)
 
-        if os.path.exists(self.fr_system.presence_json_file):
-            with open(self.fr_system.presence_json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+        data = self.fr_system.store.list_presences() + self.fr_system.journal.pending()
+        if data:
             for presence in data:
                 text.insert(END, f"Nom: {presence['nom']} | Date: {presence['date']} | Heure: {presence['heure']}\n")
         else:
@@ -442,9 +397,8 @@ class App:
         scrollbar.pack(side=RIGHT, fill=Y)
         text.config(yscrollcommand=scrollbar.set)
 
-        if os.path.exists(self.fr_system.person_file):
-            with open(self.fr_system.person_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+        data = self.fr_system.store.list_persons()
+        if data:
             for person in data:
                 text.insert(END, f"ID: {person['id']}\nNom: {person['nom']}\nEmail: {person['email']}\nTéléphone: {person['telephone']}\nActif: {'Oui' if person.get('active') else 'Non'}\n\n")
         else:
@@ -458,4 +412,6 @@ if __name__ == "__main__":
         print("⚠️ Veuillez ajouter un fichier 'success.mp3' dans le dossier.")
     root = Tk()
     app = App(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.fr_system.attendance.close()
+    app.fr_system.journal.close()
\ No newline at end of file
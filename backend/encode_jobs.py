@@ -0,0 +1,341 @@
+import json
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from datetime import datetime
+
+import numpy as np
+
+from encoding_cache import DEFAULT_PARAMS, EncodingCache, detect_and_encode, image_hash
+from file_utils import atomic_write, file_lock, release_lock, try_lock
+from gallery import DEFAULT_TEMPLATES, MAX_TEMPLATES, person_templates, to_matrix, update_gallery
+from recognition_service import default_workers
+
+# Cache en lecture seule ouvert une fois par processus du pool
+_worker_cache = None
+# Identifiant de la tâche de ré-encodage dans la table jobs du stockage
+ENCODE_ALL_JOB_ID = 'encode-all'
+
+
+def encode_image(image_path, known_hash=None, cache_folder=None, params=None):
+    """Encoder le premier visage d'une image (exécuté dans un processus du pool).
+
+    Renvoie (hash, boxes, encodage ou None, statut, depuis_le_cache); l'image
+    n'est pas décodée si son contenu n'a pas changé depuis le dernier encodage
+    ou si elle est déjà dans le cache d'encodages.
+    """
+    with open(image_path, 'rb') as f:
+        content = f.read()
+    content_hash = image_hash(content)
+    if content_hash == known_hash:
+        return content_hash, [], None, 'skipped', False
+    return encode_content(content, cache_folder, params)
+
+
+def encode_content(content, cache_folder=None, params=None):
+    """Encoder le premier visage d'une image en mémoire: (hash, boxes, encodage ou None, statut, depuis_le_cache)"""
+    global _worker_cache
+    if _worker_cache is None and cache_folder and os.path.exists(os.path.join(cache_folder, 'cache.db')):
+        _worker_cache = EncodingCache(cache_folder, readonly=True)
+    content_hash, boxes, encodings, cached = detect_and_encode(content, cache=_worker_cache, params=params)
+    if not encodings:
+        return content_hash, boxes, None, 'no_face', cached
+    return content_hash, boxes, encodings[0].tolist(), 'encoded', cached
+
+
+def encode_capture(content, cache_folder=None, params=None):
+    """Encoder une capture d'enrôlement et noter la qualité du visage.
+
+    Renvoie le résultat de encode_content suivi de la qualité (voir
+    face_quality); le statut devient 'low_quality' si la capture est refusée.
+    """
+    content_hash, boxes, encoding, result, cached = encode_content(content, cache_folder, params)
+    if result != 'encoded':
+        return content_hash, boxes, encoding, result, cached, None
+    from face_quality import capture_quality
+    quality = capture_quality(content, boxes[0], dict(DEFAULT_PARAMS, **(params or {}))['max_pixels'])
+    if not quality['accepted']:
+        result = 'low_quality'
+    return content_hash, boxes, encoding, result, cached, quality
+
+
+class EncodeAllJob:
+    """Ré-encodage de toutes les personnes en tâche de fond, sur un pool de processus.
+
+    La progression est enregistrée dans un fichier de reprise: un passage
+    interrompu repart de là où il s'était arrêté, et les images dont le hash
+    n'a pas changé ne sont pas ré-encodées. Toutes les captures d'une
+    personne sont ré-encodées et forment ses modèles dans la galerie.
+
+    L'état de la tâche est dans le stockage (table jobs), visible par tous
+    les workers de l'API; un verrou sur le fichier de reprise, tenu pendant
+    tout le passage, empêche deux ré-encodages simultanés entre processus.
+    """
+
+    def __init__(self, checkpoint_file, gallery_file, store, workers=None, checkpoint_every=50, cache=None,
+                 templates=DEFAULT_TEMPLATES, max_templates=MAX_TEMPLATES, params=None):
+        self.checkpoint_file = checkpoint_file
+        self.store = store
+        # Mêmes paramètres de détection que l'enrôlement: mêmes encodages, mêmes entrées de cache
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.templates = templates
+        self.max_templates = max_templates
+        self.cache = cache
+        self.gallery_file = gallery_file
+        self.workers = workers or default_workers()
+        self.checkpoint_every = checkpoint_every
+        self._lock = threading.Lock()
+        self._thread = None
+        self._run_lock = None
+        self._counts = {}
+        self._persons = {}
+
+    def status(self):
+        job = self.store.get_job(ENCODE_ALL_JOB_ID)
+        if job is None:
+            return {'state': 'idle'}
+        if job['state'] == 'running' and not self.running():
+            # Personne ne tient le verrou: le processus qui l'exécutait s'est arrêté
+            lock = try_lock(self.checkpoint_file)
+            if lock is not None:
+                release_lock(lock)
+                job['state'] = 'interrupted'
+        return {k: v for k, v in job.items() if k not in ('id', 'filename')}
+
+    def running(self):
+        """Vrai si le ré-encodage tourne dans ce processus"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, persons, image_paths):
+        """Lancer le ré-encodage; image_paths(person) donne les chemins de ses captures, l'image principale d'abord"""
+        with self._lock:
+            if self.running():
+                return False
+            # Non bloquant: un autre processus tient le verrou tant que son ré-encodage tourne
+            self._run_lock = try_lock(self.checkpoint_file)
+            if self._run_lock is None:
+                return False
+            try:
+                tasks = []
+                self._persons = {str(person['id']): person for person in persons}
+                for person in persons:
+                    paths = image_paths(person) if person.get('image') else []
+                    for position, path in enumerate(paths):
+                        if os.path.exists(path):
+                            # Entrée de reprise: l'id pour l'image principale, id/fichier pour les autres captures
+                            key = person['id'] if position == 0 else f"{person['id']}/{os.path.basename(path)}"
+                            tasks.append((person, path, key))
+                self._counts = {'done': 0, 'encoded': 0, 'skipped': 0, 'failed': 0}
+                self.store.add_job(dict(self._counts, id=ENCODE_ALL_JOB_ID, state='running', total=len(tasks),
+                                        started_at=datetime.now().isoformat()))
+                self._thread = threading.Thread(target=self._run, args=(tasks,), daemon=True)
+                self._thread.start()
+            except Exception:
+                release_lock(self._run_lock)
+                self._run_lock = None
+                raise
+        return True
+
+    def _update(self, **changes):
+        self.store.update_job(ENCODE_ALL_JOB_ID, **changes)
+
+    def _count(self, result):
+        self._counts['done'] += 1
+        self._counts[result] += 1
+        self._update(**self._counts)
+
+    def _run(self, tasks):
+        try:
+            checkpoint = self._load_checkpoint()
+            since_save = 0
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {}
+                cache_folder = self.cache.folder if self.cache is not None else None
+                for person, path, key in tasks:
+                    known = checkpoint.get(key, {})
+                    # Une image encodée avec d'autres paramètres de détection est ré-encodée
+                    known_hash = known.get('hash') if known.get('encoding') and known.get('params') == self.params else None
+                    futures[pool.submit(encode_image, path, known_hash, cache_folder, self.params)] = (person, key)
+
+                for future in as_completed(futures):
+                    person, key = futures[future]
+                    try:
+                        content_hash, boxes, encoding, result, cached = future.result()
+                    except Exception as e:
+                        print(f"Erreur avec {person['nom']}: {str(e)}")
+                        self._count('failed')
+                        continue
+                    if self.cache is not None and not cached and result != 'skipped':
+                        # Les processus du pool lisent le cache, seul le processus principal l'alimente
+                        self.cache.put(content_hash, self.params, boxes, [encoding] if encoding else [])
+                    if result == 'encoded':
+                        checkpoint[key] = {'hash': content_hash, 'encoding': encoding, 'params': self.params}
+                        self._count('encoded')
+                        since_save += 1
+                    elif result == 'skipped':
+                        self._count('skipped')
+                    else:
+                        checkpoint[key] = {'hash': content_hash, 'encoding': None, 'params': self.params}
+                        self._count('failed')
+                        since_save += 1
+                    if since_save >= self.checkpoint_every:
+                        self._save_checkpoint(checkpoint)
+                        since_save = 0
+
+            self._save_checkpoint(checkpoint)
+            self._write_gallery(tasks, checkpoint)
+            self._update(state='finished', finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Erreur lors du ré-encodage: {e}")
+            self._update(state='failed', error=str(e), finished_at=datetime.now().isoformat())
+        finally:
+            release_lock(self._run_lock)
+            self._run_lock = None
+
+    def _write_gallery(self, tasks, checkpoint):
+        captures = {}
+        for person, _, key in tasks:
+            encoding = checkpoint.get(key, {}).get('encoding')
+            if encoding:
+                captures.setdefault(str(person['id']), []).append(encoding)
+
+        def change(current, current_entries):
+            # Lu sous le verrou de la galerie: les suppressions, renommages et changements
+            # d'image faits pendant le ré-encodage ne sont pas écrasés
+            stored = {str(p['id']): p for p in self.store.list_persons()}
+            rebuilt = {person_id for person_id, person in self._persons.items()
+                       if person_id in stored and stored[person_id].get('image') == person.get('image')}
+            keep = [i for i, (entry_id, _) in enumerate(current_entries)
+                    if entry_id not in rebuilt and (entry_id in stored or entry_id not in self._persons)]
+            known_face_encodings = []
+            entries = []
+            for person_id, encodings in captures.items():
+                if person_id not in rebuilt:
+                    continue
+                templates = person_templates(encodings, self.templates, self.max_templates)
+                known_face_encodings.extend(templates)
+                entries.extend([(person_id, stored[person_id]['nom'])] * len(templates))
+            return (np.concatenate([current[keep], to_matrix(np.asarray(known_face_encodings, dtype=np.float32))]),
+                    [current_entries[i] for i in keep] + entries)
+        self._update(faces=update_gallery(self.gallery_file, change))
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_file):
+            try:
+                with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Erreur lors du chargement de {self.checkpoint_file}: {e}")
+        return {}
+
+    def _save_checkpoint(self, checkpoint):
+        atomic_write(self.checkpoint_file, json.dumps(checkpoint).encode('utf-8'))
+
+
+class EnrollmentQueue:
+    """File d'enrôlement asynchrone: détection et encodage sur un pool de processus.
+
+    `submit` renvoie immédiatement un identifiant de tâche. Les workers
+    détectent et encodent le visage et notent sa qualité (les captures de
+    mauvaise qualité sont refusées); un thread consommateur applique ensuite
+    `accept(content, encoding, job)` un résultat à la fois (contrôle des
+    doublons, écriture de l'image, mise de côté de l'encodage). `accept` lève
+    ValueError pour refuser l'image. Plusieurs captures d'une même personne
+    partagent le même `filename`.
+
+    L'état des tâches est dans le stockage SQLite: tous les workers de l'API
+    voient toutes les tâches. Avec `lock_path`, `accept` est aussi
+    exclusif entre processus. Seules les `history` dernières tâches sont
+    gardées pour le suivi.
+    """
+
+    def __init__(self, accept, store, workers=None, cache=None, history=1000, lock_path=None):
+        self.accept = accept
+        self.store = store
+        self.cache = cache
+        self.workers = workers or default_workers()
+        self.history = history
+        self.lock_path = lock_path
+        self._lock = threading.Lock()
+        self._pool = None
+        self._results = queue.Queue()
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+        self._consumer.start()
+
+    def submit(self, content, filename, params=None, person_id=None):
+        """Mettre une capture en file d'enrôlement (params: paramètres de détection, voir detect_and_encode;
+        person_id: personne existante à qui la capture est destinée)"""
+        job_id = str(uuid.uuid4())
+        self.store.add_job({
+            'id': job_id,
+            'state': 'queued',
+            'filename': filename,
+            'person_id': person_id,
+            'submitted_at': datetime.now().isoformat(),
+        }, history=self.history)
+        cache_folder = self.cache.folder if self.cache is not None else None
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                future = self._pool.submit(encode_capture, content, cache_folder, params)
+            except BrokenProcessPool:
+                # Un processus a été tué (mémoire, signal): on repart sur un pool neuf
+                print("⚠️ Pool d'enrôlement cassé, redémarrage")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                future = self._pool.submit(encode_capture, content, cache_folder, params)
+        # Le callback tourne sur le thread de gestion du pool: il ne fait que passer le résultat
+        future.add_done_callback(lambda f: self._results.put((job_id, content, filename, f, params)))
+        return job_id
+
+    def status(self, job_id):
+        return self.store.get_job(job_id)
+
+    def in_progress(self, filename):
+        """Vrai si l'image de ce nom n'a pas encore fini d'être enrôlée (par n'importe quel worker)"""
+        return self.store.job_in_progress(filename)
+
+    def _update(self, job_id, **changes):
+        self.store.update_job(job_id, **changes)
+
+    def _consume(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            self._finish(*item)
+
+    def _finish(self, job_id, content, filename, future, params=None):
+        self._update(job_id, state='running')
+        try:
+            content_hash, boxes, encoding, result, cached, quality = future.result()
+            if self.cache is not None and not cached:
+                self.cache.put(content_hash, dict(DEFAULT_PARAMS, **(params or {})), boxes,
+                               [encoding] if encoding else [])
+            if quality is not None:
+                self._update(job_id, quality=quality)
+            if result == 'low_quality':
+                raise ValueError("Capture refusée: " + ", ".join(quality['reasons']))
+            if result != 'encoded':
+                raise ValueError("Aucun visage détecté dans l'image")
+            # Un seul enrôlement à la fois (entre processus): les doublons d'un même lot sont détectés
+            with file_lock(self.lock_path) if self.lock_path else nullcontext():
+                job = self.status(job_id) or {'filename': filename, 'quality': quality}
+                details = self.accept(content, np.asarray(encoding), job) or {}
+            self._update(job_id, state='done', finished_at=datetime.now().isoformat(), **details)
+        except ValueError as e:
+            self._update(job_id, state='rejected', message=str(e), finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Erreur lors de l'enrôlement de {filename}: {e}")
+            self._update(job_id, state='failed', message=str(e), finished_at=datetime.now().isoformat())
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._results.put(None)
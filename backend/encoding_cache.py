@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+ENCODING_SIZE = 128
+DEFAULT_PARAMS = {'model': 'hog', 'upsample': 1, 'ladder': [1.0], 'jitters': 1, 'all_faces': False,
+                  'max_pixels': int(os.environ.get('IMAGE_MAX_PIXELS', 2_000_000))}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    boxes TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used);
+
+CREATE TABLE IF NOT EXISTS slots (
+    slot INTEGER PRIMARY KEY,
+    key TEXT,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_slots_key ON slots(key);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def image_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class EncodingCache:
+    """Cache persistant des détections et encodages, indexé par le hash de l'image.
+
+    La clé est le SHA-256 du contenu de l'image plus les paramètres de
+    détection/encodage. Les encodages sont rangés dans un fichier float32
+    mappé en mémoire (une ligne par visage) ; l'index des entrées et des
+    emplacements est une petite base SQLite, ce qui permet à plusieurs
+    processus de partager le cache. Au-delà de la capacité, les entrées les
+    moins récemment utilisées sont évincées.
+    """
+
+    def __init__(self, folder, capacity=20000, readonly=False):
+        self.folder = folder
+        self.readonly = readonly
+        self.db_path = os.path.join(folder, 'cache.db')
+        self.vectors_path = os.path.join(folder, 'vectors.f32')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        if not readonly:
+            os.makedirs(folder, exist_ok=True)
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+                row = conn.execute("SELECT value FROM meta WHERE key = 'capacity'").fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('capacity', ?)", (str(capacity),))
+                    conn.executemany('INSERT INTO slots (slot) VALUES (?)', ((i,) for i in range(capacity)))
+                else:
+                    capacity = int(row[0])
+            if not os.path.exists(self.vectors_path):
+                np.memmap(self.vectors_path, dtype=np.float32, mode='w+', shape=(capacity, ENCODING_SIZE)).flush()
+        else:
+            capacity = int(self._connect().execute("SELECT value FROM meta WHERE key = 'capacity'").fetchone()[0])
+
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r' if readonly else 'r+',
+                                 shape=(capacity, ENCODING_SIZE))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(self.db_path, timeout=30)
+                conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(content_hash, params):
+        return f"{content_hash}:{json.dumps(params, sort_keys=True)}"
+
+    def get(self, content_hash, params):
+        """(boxes, encodings) déjà calculés pour cette image, sinon None"""
+        key = self.make_key(content_hash, params)
+        conn = self._connect()
+        row = conn.execute('SELECT boxes FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        slots = [r[0] for r in conn.execute('SELECT slot FROM slots WHERE key = ? ORDER BY position', (key,))]
+        boxes = [tuple(box) for box in json.loads(row[0])]
+        if len(slots) != len(boxes):
+            return None
+        encodings = [np.array(self.vectors[slot], dtype=np.float64) for slot in slots]
+        if not self.readonly:
+            with conn:
+                conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        return boxes, encodings
+
+    def put(self, content_hash, params, boxes, encodings):
+        """Enregistrer les détections d'une image (les plus anciennes entrées sont évincées si besoin)"""
+        if self.readonly or len(encodings) > self.capacity:
+            return
+        key = self.make_key(content_hash, params)
+        conn = self._connect()
+        with self._lock, conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE slots SET key = NULL, position = NULL WHERE key = ?', (key,))
+            free = [r[0] for r in conn.execute('SELECT slot FROM slots WHERE key IS NULL LIMIT ?', (len(encodings),))]
+            while len(free) < len(encodings) or self._count(conn) >= 2 * self.capacity:
+                oldest = conn.execute('SELECT key FROM entries ORDER BY last_used LIMIT 1').fetchone()
+                if oldest is None:
+                    break
+                conn.execute('DELETE FROM entries WHERE key = ?', oldest)
+                conn.execute('UPDATE slots SET key = NULL, position = NULL WHERE key = ?', oldest)
+                free = [r[0] for r in conn.execute('SELECT slot FROM slots WHERE key IS NULL LIMIT ?', (len(encodings),))]
+
+            for position, (slot, encoding) in enumerate(zip(free, encodings)):
+                self.vectors[slot] = np.asarray(encoding, dtype=np.float32)
+                conn.execute('UPDATE slots SET key = ?, position = ? WHERE slot = ?', (key, position, slot))
+            self.vectors.flush()
+            conn.execute('INSERT OR REPLACE INTO entries (key, boxes, last_used) VALUES (?, ?, ?)',
+                         (key, json.dumps([list(box) for box in boxes]), time.time()))
+
+    @staticmethod
+    def _count(conn):
+        return conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+def detect_and_encode(content, cache=None, params=None):
+    """Détecter et encoder les visages d'une image (octets bruts), via le cache si possible.
+
+    Renvoie (hash, boxes, encodings, depuis_le_cache). Seul le premier visage
+    est encodé sauf si params['all_faces'] est vrai. L'image est décodée en
+    mémoire et réduite à params['max_pixels']; la détection suit
+    params['model'], params['upsample'] et l'échelle params['ladder'] (voir
+    face_detection). Les boîtes sont exprimées dans les dimensions d'origine.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    content_hash = image_hash(content)
+    if cache is not None:
+        cached = cache.get(content_hash, params)
+        if cached is not None:
+            return content_hash, cached[0], cached[1], True
+
+    import face_recognition
+    from face_detection import detect_faces
+    from image_io import decode_image, scale_boxes
+    image, scale = decode_image(content, params['max_pixels'])
+    boxes = detect_faces(image, params['model'], params['upsample'], params['ladder'])
+    if not params['all_faces']:
+        boxes = boxes[:1]
+    encodings = face_recognition.face_encodings(image, boxes, num_jitters=params['jitters']) if boxes else []
+    boxes = scale_boxes(boxes, scale)
+
+    if cache is not None:
+        cache.put(content_hash, params, boxes, encodings)
+    return content_hash, boxes, encodings, False
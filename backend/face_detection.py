@@ -0,0 +1,140 @@
+import os
+import threading
+
+# 'hog' et 'cnn' (dlib, via face_recognition), 'haar' et 'dnn' (OpenCV)
+DETECTORS = ('hog', 'cnn', 'haar', 'dnn')
+# Modèle SSD res10 d'OpenCV (deploy.prototxt + res10_300x300_ssd_iter_140000.caffemodel)
+DNN_MODEL = os.environ.get('FACE_DNN_MODEL', '')
+DNN_CONFIG = os.environ.get('FACE_DNN_CONFIG', '')
+DNN_CONFIDENCE = float(os.environ.get('FACE_DNN_CONFIDENCE', 0.5))
+MAX_UPSAMPLE = 3
+
+# Les détecteurs OpenCV ne sont pas partagés entre threads: un exemplaire par thread
+_local = threading.local()
+
+
+def parse_ladder(value):
+    """'0.25,0.5,1' -> [0.25, 0.5, 1.0]: échelles essayées de la plus petite à la plus grande"""
+    if isinstance(value, str):
+        value = [v for v in value.split(',') if v.strip()]
+    ladder = sorted({float(v) for v in value})
+    if not ladder or ladder[0] <= 0 or ladder[-1] > 1:
+        raise ValueError("Échelles de détection invalides (valeurs dans ]0, 1])")
+    return ladder
+
+
+def detection_params(defaults, detector=None, upsample=None, ladder=None):
+    """Paramètres de détection d'un endpoint, éventuellement surchargés (paramètres de requête, variables d'environnement).
+
+    Renvoie {'model', 'upsample', 'ladder'}; lève ValueError si une valeur est invalide.
+    """
+    params = dict(defaults)
+    if detector:
+        params['model'] = detector
+    if upsample not in (None, ''):
+        params['upsample'] = int(upsample)
+    if ladder:
+        params['ladder'] = ladder
+    if params['model'] not in DETECTORS:
+        raise ValueError(f"Détecteur inconnu: {params['model']} (choix: {', '.join(DETECTORS)})")
+    if not 0 <= params['upsample'] <= MAX_UPSAMPLE:
+        raise ValueError(f"upsample doit être compris entre 0 et {MAX_UPSAMPLE}")
+    params['ladder'] = parse_ladder(params.get('ladder', [1.0]))
+    return params
+
+
+def env_detection_params(defaults, prefix=''):
+    """Paramètres de détection lus dans l'environnement: {prefix}FACE_DETECTOR, {prefix}FACE_UPSAMPLE, {prefix}DETECTION_LADDER"""
+    return detection_params(defaults,
+                            os.environ.get(f'{prefix}FACE_DETECTOR'),
+                            os.environ.get(f'{prefix}FACE_UPSAMPLE'),
+                            os.environ.get(f'{prefix}DETECTION_LADDER'))
+
+
+def detect_faces(rgb, model='hog', upsample=1, ladder=(1.0,)):
+    """Boîtes (top, right, bottom, left) des visages d'une image RGB.
+
+    L'image est d'abord analysée à la plus petite échelle de `ladder`; on
+    ne passe à l'échelle suivante que si aucun visage n'a été trouvé. Les
+    boîtes sont rendues dans les dimensions de l'image reçue.
+    """
+    import cv2
+    height, width = rgb.shape[:2]
+    for scale in ladder:
+        image = rgb
+        if scale < 1.0:
+            image = cv2.resize(rgb, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        boxes = _detect(image, model, upsample)
+        if boxes:
+            return [_clip(tuple(int(round(v / scale)) for v in box), width, height) for box in boxes]
+    return []
+
+
+def _clip(box, width, height):
+    top, right, bottom, left = box
+    return max(0, top), min(width, right), min(height, bottom), max(0, left)
+
+
+def _detect(rgb, model, upsample):
+    if model in ('hog', 'cnn'):
+        import face_recognition
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=upsample, model=model)
+    if model == 'haar':
+        return _detect_haar(rgb, upsample)
+    if model == 'dnn':
+        return _detect_dnn(rgb)
+    raise ValueError(f"Détecteur inconnu: {model}")
+
+
+def _haar_cascade():
+    cascade = getattr(_local, 'haar', None)
+    if cascade is None:
+        import cv2
+        cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+        if cascade.empty():
+            raise ValueError("Cascade de Haar introuvable dans l'installation d'OpenCV")
+        _local.haar = cascade
+    return cascade
+
+
+def _detect_haar(rgb, upsample):
+    """Cascade de Haar fournie avec OpenCV: rapide, visages de face uniquement"""
+    import cv2
+    factor = 2 ** upsample
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    if factor > 1:
+        gray = cv2.resize(gray, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_LINEAR)
+    gray = cv2.equalizeHist(gray)
+    faces = _haar_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    return [(int(y / factor), int((x + w) / factor), int((y + h) / factor), int(x / factor))
+            for x, y, w, h in faces]
+
+
+def _dnn_net():
+    net = getattr(_local, 'dnn', None)
+    if net is None:
+        import cv2
+        if not (os.path.exists(DNN_MODEL) and os.path.exists(DNN_CONFIG)):
+            raise ValueError("Détecteur DNN non configuré (FACE_DNN_MODEL et FACE_DNN_CONFIG)")
+        net = _local.dnn = cv2.dnn.readNetFromCaffe(DNN_CONFIG, DNN_MODEL)
+    return net
+
+
+def _detect_dnn(rgb):
+    """Détecteur SSD d'OpenCV (entrée 300x300, robuste aux visages de profil)"""
+    import cv2
+    height, width = rgb.shape[:2]
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    blob = cv2.dnn.blobFromImage(cv2.resize(bgr, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+    net = _dnn_net()
+    net.setInput(blob)
+    detections = net.forward()[0, 0]
+    boxes = []
+    for detection in detections:
+        if detection[2] < DNN_CONFIDENCE:
+            continue
+        left, top, right, bottom = (detection[3:7] * [width, height, width, height]).astype(int)
+        if right > left and bottom > top:
+            boxes.append((int(top), int(right), int(bottom), int(left)))
+    return boxes
@@ -0,0 +1,189 @@
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+def pairwise_distances(queries, vectors, sq_norms=None):
+    """Distances euclidiennes (M, N) calculées en un seul produit matriciel"""
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+    # |a - b|² = |a|² - 2 a.b + |b|²
+    sq = sq_norms[None, :] - 2.0 * (queries @ vectors.T)
+    sq += np.einsum('ij,ij->i', queries, queries)[:, None]
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def top_k(distances, ids, k):
+    """Les k plus petites distances triées: (ids, distances)"""
+    if len(distances) > k:
+        keep = np.argpartition(distances, k - 1)[:k]
+        distances, ids = distances[keep], ids[keep]
+    order = np.argsort(distances)
+    return ids[order], distances[order]
+
+
+def as_matrix(vectors):
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+
+
+class FlatIndex:
+    """Index exact: balayage complet de la matrice des encodages"""
+
+    def __init__(self):
+        self._buffer = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self._norms_buffer = np.empty((0,), dtype=np.float32)
+        # Vues publiées (encodages, normes²) : un ajout ne modifie jamais les lignes déjà visibles
+        self._state = (self._buffer, self._norms_buffer)
+
+    def __len__(self):
+        return len(self._state[0])
+
+    @property
+    def vectors(self):
+        return self._state[0]
+
+    def build(self, vectors):
+        # Pas de copie: la matrice de la galerie est déjà en mémoire
+        vectors = as_matrix(vectors)
+        self._buffer, self._norms_buffer = vectors, np.einsum('ij,ij->i', vectors, vectors)
+        self._state = (self._buffer, self._norms_buffer)
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        size = len(self)
+        needed = size + len(vectors)
+        if needed > len(self._buffer):
+            # Capacité doublée: ajout en O(1) amorti au lieu de recopier toute la matrice
+            capacity = max(needed, 2 * len(self._buffer), 64)
+            buffer = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+            norms = np.empty((capacity,), dtype=np.float32)
+            buffer[:size] = self._buffer[:size]
+            norms[:size] = self._norms_buffer[:size]
+            self._buffer, self._norms_buffer = buffer, norms
+        self._buffer[size:needed] = vectors
+        self._norms_buffer[size:needed] = np.einsum('ij,ij->i', vectors, vectors)
+        self._state = (self._buffer[:needed], self._norms_buffer[:needed])
+
+    def search(self, queries, k=1):
+        """Pour chaque requête, les k voisins les plus proches: liste de (ids, distances)"""
+        vectors, sq_norms = self._state
+        queries = as_matrix(queries)
+        if not len(vectors):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        distances = pairwise_distances(queries, vectors, sq_norms)
+        ids = np.arange(len(vectors))
+        return [top_k(row, ids, k) for row in distances]
+
+
+class IVFIndex:
+    """Index approché de type IVF: partitionnement grossier par k-means.
+
+    Chaque encodage est rangé dans la liste de son centroïde le plus proche ;
+    une requête ne parcourt que les `nprobe` listes les plus proches puis
+    calcule les distances exactes sur ces seuls candidats. Les ajouts sont
+    incrémentaux, et l'index est ré-entraîné quand la galerie a beaucoup grossi.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=1024, retrain_factor=4, iterations=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.iterations = iterations
+        self.seed = seed
+        self.flat = FlatIndex()
+        # (centroïdes, listes inversées), remplacés ensemble
+        self._partition = (None, [])
+        self.trained_size = 0
+
+    def __len__(self):
+        return len(self.flat)
+
+    @property
+    def vectors(self):
+        return self.flat.vectors
+
+    def build(self, vectors):
+        self.flat.build(vectors)
+        self._partition = (None, [])
+        self.trained_size = 0
+        self._maybe_train()
+
+    def add(self, vectors):
+        vectors = as_matrix(vectors)
+        start = len(self.flat)
+        self.flat.add(vectors)
+        centroids, lists = self._partition
+        if centroids is None or len(self.flat) >= self.trained_size * self.retrain_factor:
+            self._maybe_train()
+            return
+        assignments = np.argmin(pairwise_distances(vectors, centroids), axis=1)
+        lists = list(lists)
+        for cluster in np.unique(assignments):
+            new_ids = start + np.flatnonzero(assignments == cluster)
+            lists[cluster] = np.concatenate([lists[cluster], new_ids])
+        self._partition = (centroids, lists)
+
+    def _maybe_train(self):
+        vectors = self.flat._state[0]
+        if len(vectors) < self.min_train_size:
+            return
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        centroids = kmeans(vectors, nlist, self.iterations, self.seed)
+        assignments = np.argmin(pairwise_distances(vectors, centroids), axis=1)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._partition = (centroids, [order[bounds[i]:bounds[i + 1]] for i in range(nlist)])
+        self.trained_size = len(vectors)
+
+    def search(self, queries, k=1):
+        """Pour chaque requête, les k voisins approchés: liste de (ids, distances)"""
+        queries = as_matrix(queries)
+        centroids, lists = self._partition
+        if centroids is None:
+            # Galerie trop petite pour être partitionnée: recherche exacte
+            return self.flat.search(queries, k)
+
+        vectors, sq_norms = self.flat._state
+        nprobe = min(self.nprobe, len(centroids))
+        probes = np.argpartition(pairwise_distances(queries, centroids), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, clusters in zip(queries, probes):
+            ids = np.concatenate([lists[c] for c in clusters])
+            if not len(ids):
+                results.append((ids, np.empty(0, dtype=np.float32)))
+                continue
+            distances = pairwise_distances(query[None, :], vectors[ids], sq_norms[ids])[0]
+            results.append(top_k(distances, ids, k))
+        return results
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0, sample_size=65536):
+    """K-means simple (Lloyd) en NumPy, entraîné sur un échantillon"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmin(pairwise_distances(vectors, centroids), axis=1)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_clusters)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+    return centroids
+
+
+INDEX_TYPES = {
+    'flat': FlatIndex,
+    'ivf': IVFIndex,
+}
+
+
+def make_index(kind='flat', **options):
+    """Créer un index par son nom ('flat' ou 'ivf')"""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Type d'index inconnu: {kind}")
+    return INDEX_TYPES[kind](**options)
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+# Seuils d'acceptation d'une capture d'enrôlement
+MIN_FACE_SIZE = int(os.environ.get('FACE_MIN_SIZE', 80))            # plus petit côté du visage (pixels, image d'origine)
+MIN_SHARPNESS = float(os.environ.get('FACE_MIN_SHARPNESS', 40.0))   # variance du laplacien sur le visage ramené à 128 px
+MIN_FRONTAL = float(os.environ.get('FACE_MIN_FRONTAL', 0.5))        # 1 = de face, 0 = de profil
+SHARPNESS_SIZE = 128
+
+
+def frontal_score(landmarks):
+    """Score de pose à partir des 5 points de dlib (yeux et bout du nez).
+
+    De face, le nez se projette au milieu des deux yeux; il s'en écarte quand
+    la tête tourne. L'écart est mesuré le long de l'axe des yeux et rapporté
+    à la distance entre les yeux: l'inclinaison de la tête n'est pas pénalisée.
+    """
+    left = np.mean(landmarks['left_eye'], axis=0)
+    right = np.mean(landmarks['right_eye'], axis=0)
+    nose = np.asarray(landmarks['nose_tip'][0], dtype=float)
+    axis = right - left
+    eye_distance = float(np.linalg.norm(axis))
+    if eye_distance == 0:
+        return 0.0
+    offset = float(np.dot(nose - (left + right) / 2.0, axis / eye_distance)) / eye_distance
+    return max(0.0, 1.0 - 2.0 * abs(offset))
+
+
+def sharpness(gray_face):
+    """Netteté: variance du laplacien, à taille de visage constante pour que les scores soient comparables"""
+    import cv2
+    face = cv2.resize(gray_face, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(face, cv2.CV_64F).var())
+
+
+def face_quality(rgb, box, scale=1.0):
+    """Qualité d'un visage détecté: taille, netteté et pose.
+
+    `box` est (top, right, bottom, left) dans l'image `rgb`; `scale` est le
+    facteur de réduction appliqué à l'image (taille exprimée dans l'image
+    d'origine). Renvoie un dict avec les mesures, un score global entre 0 et
+    1, `accepted` et les raisons d'un éventuel refus.
+    """
+    import cv2
+    import face_recognition
+    top, right, bottom, left = box
+    height, width = rgb.shape[:2]
+    top, left = max(0, top), max(0, left)
+    bottom, right = min(height, bottom), min(width, right)
+    size = min(bottom - top, right - left) / scale
+    gray = cv2.cvtColor(rgb[top:bottom, left:right], cv2.COLOR_RGB2GRAY)
+    sharp = sharpness(gray) if gray.size else 0.0
+    landmarks = face_recognition.face_landmarks(rgb, [(top, right, bottom, left)], model='small')
+    frontal = frontal_score(landmarks[0]) if landmarks else 0.0
+
+    reasons = []
+    if size < MIN_FACE_SIZE:
+        reasons.append(f"visage trop petit ({int(size)} px, minimum {MIN_FACE_SIZE})")
+    if sharp < MIN_SHARPNESS:
+        reasons.append(f"image floue (netteté {sharp:.0f}, minimum {MIN_SHARPNESS:.0f})")
+    if frontal < MIN_FRONTAL:
+        reasons.append(f"visage pas de face (score {frontal:.2f}, minimum {MIN_FRONTAL:.2f})")
+    score = (min(1.0, size / (2.0 * MIN_FACE_SIZE)) * min(1.0, sharp / (2.0 * MIN_SHARPNESS)) * frontal
+             if MIN_FACE_SIZE and MIN_SHARPNESS else frontal)
+    return {
+        'size': int(size),
+        'sharpness': round(sharp, 1),
+        'frontal': round(frontal, 3),
+        'score': round(score, 3),
+        'accepted': not reasons,
+        'reasons': reasons,
+    }
+
+
+def capture_quality(content, box, max_pixels):
+    """Qualité du visage `box` (dimensions d'origine) d'une image en octets bruts"""
+    from image_io import decode_image
+    rgb, scale = decode_image(content, max_pixels)
+    return face_quality(rgb, tuple(int(round(v * scale)) for v in box), scale)
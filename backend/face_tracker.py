@@ -0,0 +1,197 @@
+import itertools
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def iou(a, b):
+    """Intersection sur union de deux boîtes (top, right, bottom, left)"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """Un visage suivi d'une image à l'autre, avec son identité"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box):
+        self.track_id = next(self._ids)
+        self.box = box
+        self.person_id = None
+        self.name = "Inconnu"
+        self.distance = None
+        self.confidence = 1.0
+        self.missed = 0
+        self.frames_since_identified = 0
+        self.points = None
+        self.identifying = False
+
+    @property
+    def identified(self):
+        return self.person_id is not None
+
+
+class FaceTracker:
+    """Suivi des visages entre les images pour éviter de ré-encoder à chaque image.
+
+    La détection complète ne tourne que toutes les `redetect_every` images,
+    ou plus tôt si le suivi devient peu fiable. Entre deux détections, les
+    boîtes sont déplacées par flux optique (Lucas-Kanade). À chaque détection,
+    les boîtes sont associées aux pistes existantes par IoU: une piste déjà
+    identifiée garde son identité et n'est ré-encodée que toutes les
+    `reidentify_every` images.
+
+    `detect(rgb)` renvoie des boîtes (top, right, bottom, left);
+    `identify(rgb, boxes)` renvoie un (person_id, nom, distance) par boîte.
+
+    `update` peut être appelé par plusieurs threads: détection et encodage
+    tournent hors du verrou, seules l'association et le flux optique le
+    prennent. Avec `seq` (numéro de l'image), une image plus ancienne que la
+    dernière appliquée ne modifie plus les pistes.
+    """
+
+    def __init__(self, detect, identify, redetect_every=10, reidentify_every=30,
+                 iou_threshold=0.3, min_confidence=0.5, max_missed=2):
+        self.detect = detect
+        self.identify = identify
+        self.redetect_every = redetect_every
+        self.reidentify_every = reidentify_every
+        self.iou_threshold = iou_threshold
+        self.min_confidence = min_confidence
+        self.max_missed = max_missed
+        self.tracks = []
+        self._frames_since_detection = 0
+        self._prev_gray = None
+        self._seq = None
+        self._lock = threading.Lock()
+
+    def update(self, rgb_frame, record=None, seq=None):
+        """Traiter une image et renvoyer les pistes courantes"""
+        record = record or (lambda stage, seconds: None)
+        gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+
+        with self._lock:
+            if self._stale(seq):
+                return list(self.tracks)
+            need_detection = (
+                not self.tracks
+                or self._prev_gray is None
+                or self._frames_since_detection >= self.redetect_every
+                or any(t.confidence < self.min_confidence for t in self.tracks)
+            )
+            if not need_detection:
+                start = time.perf_counter()
+                self._follow(gray)
+                record('track', time.perf_counter() - start)
+                self._frames_since_detection += 1
+                self._applied(gray, seq)
+                return list(self.tracks)
+
+        start = time.perf_counter()
+        boxes = self.detect(rgb_frame)
+        record('detect', time.perf_counter() - start)
+
+        with self._lock:
+            # Une image plus récente a été appliquée pendant la détection: celle-ci est dépassée
+            if self._stale(seq):
+                return list(self.tracks)
+            to_identify = self._associate(gray, boxes)
+            self._frames_since_detection = 0
+            self._applied(gray, seq)
+            for track in to_identify:
+                track.identifying = True
+
+        if to_identify:
+            start = time.perf_counter()
+            try:
+                identities = self.identify(rgb_frame, [t.box for t in to_identify])
+            finally:
+                with self._lock:
+                    for track in to_identify:
+                        track.identifying = False
+            record('identify', time.perf_counter() - start)
+            with self._lock:
+                for track, (person_id, name, distance) in zip(to_identify, identities):
+                    track.person_id, track.name, track.distance = person_id, name or "Inconnu", distance
+                    track.frames_since_identified = 0
+        with self._lock:
+            return list(self.tracks)
+
+    def _stale(self, seq):
+        return seq is not None and self._seq is not None and seq <= self._seq
+
+    def _applied(self, gray, seq):
+        for track in self.tracks:
+            track.frames_since_identified += 1
+        self._prev_gray = gray
+        if seq is not None:
+            self._seq = seq
+
+    def _associate(self, gray, boxes):
+        """Associer les boîtes détectées aux pistes; renvoie les pistes à (ré)identifier"""
+        # Association gloutonne par IoU décroissant
+        pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)),
+                       reverse=True)
+        matched_tracks, matched_boxes = {}, set()
+        for score, ti, bi in pairs:
+            if score < self.iou_threshold:
+                break
+            if ti in matched_tracks or bi in matched_boxes:
+                continue
+            matched_tracks[ti] = bi
+            matched_boxes.add(bi)
+
+        tracks = []
+        for ti, track in enumerate(self.tracks):
+            if ti in matched_tracks:
+                track.box = boxes[matched_tracks[ti]]
+                track.missed = 0
+                tracks.append(track)
+            else:
+                track.missed += 1
+                if track.missed <= self.max_missed:
+                    tracks.append(track)
+        tracks += [Track(box) for bi, box in enumerate(boxes) if bi not in matched_boxes]
+
+        for track in tracks:
+            track.confidence = 1.0
+            track.points = self._features(gray, track.box)
+        self.tracks = tracks
+
+        # Seules les pistes nouvelles, inconnues ou anciennes sont (ré)encodées, une fois à la fois
+        return [t for t in tracks if t.missed == 0 and not t.identifying and (
+            not t.identified or t.frames_since_identified >= self.reidentify_every)]
+
+    @staticmethod
+    def _features(gray, box):
+        top, right, bottom, left = box
+        mask = np.zeros_like(gray)
+        mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=3, mask=mask)
+
+    def _follow(self, gray):
+        """Déplacer chaque boîte selon le flux optique médian de ses points"""
+        height, width = gray.shape[:2]
+        for track in self.tracks:
+            if track.points is None or len(track.points) == 0:
+                track.confidence = 0.0
+                continue
+            points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None)
+            ok = status.reshape(-1) == 1
+            track.confidence = float(ok.mean()) if len(ok) else 0.0
+            if not ok.any():
+                continue
+            dx, dy = np.median((points[ok] - track.points[ok]).reshape(-1, 2), axis=0)
+            top, right, bottom, left = track.box
+            dx, dy = int(round(dx)), int(round(dy))
+            track.box = (min(max(top + dy, 0), height), min(max(right + dx, 0), width),
+                         min(max(bottom + dy, 0), height), min(max(left + dx, 0), width))
+            track.points = points[ok].reshape(-1, 1, 2)
@@ -0,0 +1,108 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class VersionConflict(Exception):
+    """Le fichier a été modifié par un autre processus depuis sa lecture"""
+
+    def __init__(self, path, expected, actual):
+        super().__init__(f"{path} a changé (version {actual}, attendue {expected})")
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
+
+# Un verrou de thread par fichier: flock ne protège pas deux threads du même processus
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+
+@contextmanager
+def file_lock(path):
+    """Verrou exclusif (entre threads et entre processus) associé à un fichier.
+
+    Le verrou porte sur un fichier compagnon `path.lock`, pour que le fichier
+    lui-même puisse être remplacé atomiquement pendant qu'on le tient. Les
+    verrous sont consultatifs: tous les programmes doivent passer par ici
+    (l'API, ses workers et main.py).
+    """
+    with _thread_lock(path):
+        with open(f'{path}.lock', 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def try_lock(path):
+    """Verrou exclusif non bloquant sur `path.lock`, tenu tant que le fichier renvoyé reste ouvert.
+
+    Renvoie None si un autre processus le tient déjà: sert à savoir si le
+    propriétaire d'un fichier (journal d'un worker) est encore en vie.
+    """
+    lock_file = open(f'{path}.lock', 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def release_lock(lock_file, remove=False):
+    """Libérer un verrou obtenu par try_lock (et supprimer son fichier si `remove`)"""
+    if remove:
+        try:
+            os.remove(lock_file.name)
+        except OSError:
+            pass
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    lock_file.close()
+
+
+def atomic_write(path, data):
+    """Écrire dans un fichier temporaire puis le renommer: jamais de fichier tronqué"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
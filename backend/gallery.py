@@ -0,0 +1,287 @@
+import json
+import os
+import struct
+import threading
+from collections import Counter
+
+import numpy as np
+
+from face_index import make_index
+from file_utils import VersionConflict, atomic_write, file_lock
+
+ENCODING_SIZE = 128
+DEFAULT_TOLERANCE = 0.6
+# Modèles par personne: 'multi' garde plusieurs captures (les meilleures d'abord), 'centroid' leur moyenne
+DEFAULT_TEMPLATES = os.environ.get('GALLERY_TEMPLATES', 'multi')
+MAX_TEMPLATES = int(os.environ.get('GALLERY_MAX_TEMPLATES', 5))
+
+# Format binaire de la galerie (sans pickle):
+#   en-tête de 64 octets: magic, version, dimension, nombre d'encodages,
+#   génération (incrémentée à chaque écriture, pour les contrôles de version)
+#   matrice float32 little-endian (N, dimension)
+#   table des identifiants: JSON UTF-8 [[person_id, nom], ...]
+GALLERY_MAGIC = b'FGAL'
+GALLERY_VERSION = 1
+HEADER = struct.Struct('<4sIIQQ')
+HEADER_SIZE = 64
+
+
+def save_gallery(path, encodings, entries, generation=0):
+    """Écrire la galerie (encodages + table person_id/nom), remplacement atomique du fichier"""
+    encodings = to_matrix(np.asarray(encodings, dtype=np.float32))
+    entries = [[str(person_id), str(nom)] for person_id, nom in entries]
+    if len(entries) != len(encodings):
+        raise ValueError(f"{len(encodings)} encodages pour {len(entries)} identifiants")
+
+    # Le fichier est lu en mémoire, jamais mappé: sous Windows, os.replace échoue sur un fichier mappé
+    atomic_write(path, [
+        HEADER.pack(GALLERY_MAGIC, GALLERY_VERSION, ENCODING_SIZE, len(entries), generation).ljust(HEADER_SIZE, b'\0'),
+        encodings.astype('<f4', copy=False).tobytes(),
+        json.dumps(entries, ensure_ascii=False).encode('utf-8'),
+    ])
+
+
+def gallery_generation(path):
+    """Génération courante du fichier de galerie (0 s'il n'existe pas)"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return HEADER.unpack(f.read(HEADER_SIZE)[:HEADER.size])[4]
+
+
+def load_gallery(path):
+    """Lire la galerie: (matrice float32 en mémoire, [(person_id, nom), ...])"""
+    with open(path, 'rb') as f:
+        magic, version, dim, count, _ = HEADER.unpack(f.read(HEADER_SIZE)[:HEADER.size])
+        if magic != GALLERY_MAGIC:
+            raise ValueError(f"{path} n'est pas un fichier de galerie")
+        if version != GALLERY_VERSION or dim != ENCODING_SIZE:
+            raise ValueError(f"Version de galerie non supportée: v{version}, dimension {dim}")
+        encodings = np.fromfile(f, dtype='<f4', count=count * dim).reshape(count, dim)
+        if len(encodings) != count:
+            raise ValueError(f"{path} est tronqué")
+        entries = [tuple(entry) for entry in json.loads(f.read().decode('utf-8'))]
+    return encodings.astype(np.float32, copy=False), entries
+
+
+def convert_legacy(encodings_file, names_file, persons, gallery_file):
+    """Convertir les anciens encodings.npy / names.npy (indexés par nom) vers le format binaire"""
+    encodings = to_matrix(np.load(encodings_file, allow_pickle=True))
+    names = [str(n) for n in np.load(names_file, allow_pickle=True).tolist()]
+    ids_by_name = {person['nom']: person['id'] for person in persons}
+    kept_encodings, entries = [], []
+    for encoding, name in zip(encodings, names):
+        if name not in ids_by_name:
+            print(f"⚠️ Encodage ignoré: aucune personne nommée {name}")
+            continue
+        kept_encodings.append(encoding)
+        entries.append((ids_by_name[name], name))
+    save_gallery(gallery_file, np.array(kept_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE), entries)
+    print(f"✅ Galerie convertie: {len(entries)} encodage(s) dans {gallery_file}")
+    return len(entries)
+
+
+def update_gallery(path, change, expected_generation=None):
+    """Transaction sur le fichier de galerie, sous verrou entre threads et processus.
+
+    `change(encodings, entries)` reçoit une copie de la galerie et renvoie la
+    nouvelle (encodings, entries); le fichier n'est remplacé que si `change`
+    aboutit, sinon il reste intact. Avec `expected_generation`, lève
+    VersionConflict si la galerie a été modifiée depuis cette génération.
+    """
+    with file_lock(path):
+        encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        entries = []
+        generation = gallery_generation(path)
+        if expected_generation is not None and generation != expected_generation:
+            raise VersionConflict(path, expected_generation, generation)
+        if os.path.exists(path):
+            encodings, entries = load_gallery(path)
+            encodings = np.array(encodings)
+        encodings, entries = change(encodings, list(entries))
+        save_gallery(path, encodings, entries, generation + 1)
+        return len(entries)
+
+
+def set_person_encodings(path, person_id, nom, encodings, expected_generation=None):
+    """Remplacer les encodages d'une personne (ajout si elle n'en avait pas)"""
+    person_id = str(person_id)
+    new = to_matrix(np.asarray(encodings, dtype=np.float32))
+
+    def change(current, entries):
+        keep = [i for i, (entry_id, _) in enumerate(entries) if entry_id != person_id]
+        return (np.concatenate([current[keep], new]),
+                [entries[i] for i in keep] + [(person_id, nom)] * len(new))
+    return update_gallery(path, change, expected_generation)
+
+
+def person_templates(encodings, mode=DEFAULT_TEMPLATES, max_templates=MAX_TEMPLATES):
+    """Encodages à enregistrer pour une personne à partir de ses captures, classées de la meilleure à la moins bonne"""
+    encodings = to_matrix(np.asarray(encodings, dtype=np.float32))
+    if mode == 'centroid' and len(encodings):
+        return encodings.mean(axis=0, keepdims=True)
+    if mode not in ('multi', 'centroid'):
+        raise ValueError(f"Mode de modèles inconnu: {mode}")
+    return encodings[:max_templates]
+
+
+def rename_person(path, person_id, nom):
+    """Mettre à jour le nom associé aux encodages d'une personne"""
+    person_id = str(person_id)
+    return update_gallery(path, lambda current, entries: (
+        current, [(entry_id, nom if entry_id == person_id else entry_nom) for entry_id, entry_nom in entries]))
+
+
+def remove_persons(path, person_ids):
+    """Supprimer tous les encodages des personnes données"""
+    person_ids = {str(person_id) for person_id in person_ids}
+
+    def change(current, entries):
+        keep = [i for i, (entry_id, _) in enumerate(entries) if entry_id not in person_ids]
+        return current[keep], [entries[i] for i in keep]
+    return update_gallery(path, change)
+
+
+class FaceGallery:
+    """Galerie des visages connus, gardée en mémoire pour tout le processus.
+
+    Le fichier de galerie est lu d'un bloc (pas de désérialisation: la
+    matrice est copiée telle quelle depuis le disque). La
+    recherche passe par un index interchangeable ('flat' exact ou 'ivf'
+    approché), et le fichier n'est relu que lorsqu'il change sur le disque.
+    Une personne peut avoir plusieurs encodages (modèles): les recherches
+    renvoient les personnes les plus proches, chacune à la distance de son
+    meilleur modèle.
+    """
+
+    def __init__(self, gallery_file, tolerance=DEFAULT_TOLERANCE, index='flat', index_options=None):
+        self.gallery_file = gallery_file
+        self.tolerance = tolerance
+        self.index_kind = index
+        self.index_options = index_options or {}
+        self._state = ([], self._new_index())
+        self._signature = None
+        self._lock = threading.Lock()
+        self._templates = Counter()   # person_id -> nombre d'encodages
+        self._max_templates = 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def encodings(self):
+        return self._state[1].vectors
+
+    @property
+    def entries(self):
+        return self._state[0]
+
+    def _new_index(self):
+        return make_index(self.index_kind, **self.index_options)
+
+    def _file_signature(self):
+        """Signature (mtime, taille, inode) du fichier de galerie"""
+        try:
+            stat = os.stat(self.gallery_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def refresh(self):
+        """Recharger la galerie uniquement si le fichier a changé"""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._load()
+            self._signature = signature
+        return True
+
+    def _load(self):
+        encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        entries = []
+        try:
+            if os.path.exists(self.gallery_file):
+                encodings, entries = load_gallery(self.gallery_file)
+        except Exception as e:
+            print(f"Erreur lors du chargement de la galerie: {e}")
+
+        current_entries, index = self._state
+        size = len(current_entries)
+        if (0 < size <= len(entries) and entries[:size] == current_entries
+                and np.array_equal(encodings[:size], index.vectors[:size])):
+            # Le fichier n'a fait que grossir: ajout incrémental dans l'index
+            if len(entries) > size:
+                self._add(encodings[size:], entries[size:])
+            return
+
+        index = self._new_index()
+        index.build(encodings)
+        self._templates = Counter(entry_id for entry_id, _ in entries)
+        self._max_templates = max(self._templates.values(), default=1)
+        self._state = (entries, index)
+
+    def _add(self, encodings, entries):
+        current_entries, index = self._state
+        self._templates.update(entry_id for entry_id, _ in entries)
+        self._max_templates = max(self._templates.values(), default=1)
+        index.add(encodings)
+        self._state = (current_entries + entries, index)
+
+    def search(self, encoding, k=1):
+        """Les k personnes les plus proches d'un encodage: liste de (person_id, nom, distance)"""
+        return self.search_many([encoding], k)[0]
+
+    def search_many(self, queries, k=1):
+        """Recherche des k personnes les plus proches pour plusieurs encodages à la fois.
+
+        Avec m modèles au plus par personne, les k*m encodages les plus proches
+        contiennent forcément les k personnes les plus proches: on les parcourt
+        en ne gardant que le meilleur modèle de chaque personne.
+        """
+        entries, index = self._state
+        depth = k * self._max_templates
+        results = []
+        for ids, distances in index.search(queries, depth):
+            if depth == k:
+                results.append([entries[i] + (float(d),) for i, d in zip(ids, distances) if i < len(entries)])
+                continue
+            found, seen = [], set()
+            for i, d in zip(ids, distances):
+                if i >= len(entries) or entries[i][0] in seen:
+                    continue
+                seen.add(entries[i][0])
+                found.append(entries[i] + (float(d),))
+                if len(found) == k:
+                    break
+            results.append(found)
+        return results
+
+    def match(self, encoding, tolerance=None):
+        """(person_id, nom, distance) du visage le plus proche; person_id et nom valent None au-delà de la tolérance"""
+        tolerance = self.tolerance if tolerance is None else tolerance
+        best = self.search(encoding, k=1)
+        if best and best[0][2] <= tolerance:
+            return best[0]
+        return None, None, (best[0][2] if best else None)
+
+
+def to_matrix(encodings):
+    """Convertir un tableau d'encodages (objet ou float) en matrice float32 (N, 128)"""
+    if encodings.size == 0:
+        return np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    if encodings.dtype == object and encodings.ndim == 1:
+        encodings = np.stack([np.asarray(e, dtype=np.float32) for e in encodings])
+    return np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+
+if __name__ == '__main__':
+    # Conversion manuelle: python gallery.py [dossier_data]
+    import sys
+    from store import Store
+    data_folder = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    convert_legacy(os.path.join(data_folder, 'encodings.npy'), os.path.join(data_folder, 'names.npy'),
+                   Store(os.path.join(data_folder, 'pointage.db')).list_persons(),
+                   os.path.join(data_folder, 'gallery.bin'))
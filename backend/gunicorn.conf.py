@@ -0,0 +1,16 @@
+# Configuration gunicorn: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('THREADS', 4))
+timeout = 120
+
+
+def post_worker_init(worker):
+    # Services créés dans le worker, pas à l'import (les processus des pools ré-importent app.py)
+    from app import init, warm_up
+    init()
+    # Préchauffage optionnel: le worker ne reçoit du trafic qu'une fois les modèles chargés
+    if os.environ.get('WARMUP') == '1':
+        warm_up()
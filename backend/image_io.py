@@ -0,0 +1,33 @@
+import os
+
+import cv2
+import numpy as np
+
+# Au-delà de ce nombre de pixels, l'image est réduite avant la détection (0 = jamais)
+MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 2_000_000))
+
+
+def decode_image(content, max_pixels=MAX_PIXELS):
+    """Décoder une image (octets bruts) en RGB, sans passer par le disque.
+
+    Renvoie (image RGB, échelle): l'échelle est le facteur appliqué si l'image
+    a été réduite à `max_pixels`, pour ramener les boîtes aux dimensions
+    d'origine.
+    """
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Image illisible ou format non supporté")
+    scale = 1.0
+    height, width = image.shape[:2]
+    if max_pixels and height * width > max_pixels:
+        scale = (max_pixels / float(height * width)) ** 0.5
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), scale
+
+
+def scale_boxes(boxes, scale):
+    """Ramener des boîtes (top, right, bottom, left) détectées sur l'image réduite à l'image d'origine"""
+    if scale == 1.0:
+        return [tuple(box) for box in boxes]
+    return [tuple(int(round(v / scale)) for v in box) for box in boxes]
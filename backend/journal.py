@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from file_utils import release_lock, try_lock
+
+
+class PresenceJournal:
+    """Journal append-only des présences (une ligne JSON par pointage).
+
+    Un pointage n'est qu'un ajout d'une ligne en fin de fichier ; les doublons
+    (person_id, date) sont détectés en O(1) par un ensemble en mémoire. Un
+    thread de fond compacte périodiquement le journal : les présences sont
+    insérées par lots dans le stockage SQLite et archivées dans des segments
+    datés (presences-AAAA-MM-JJ.jsonl).
+
+    Chaque processus (workers de l'API, kiosque, serveur) écrit dans son
+    propre fichier (presences.<pid>.jsonl), verrouillé tant qu'il vit; au
+    démarrage, les fichiers laissés par des processus arrêtés sont versés
+    dans le stockage. Entre processus, chaque pointage (person_id, date) est
+    réservé dans le stockage (presence_claims) au moment de l'ajout: `add`
+    refuse tout de suite un doublon enregistré par un autre processus, et
+    l'index unique de la table des présences reste le dernier garde-fou.
+    """
+
+    def __init__(self, store, folder, name='presences', interval=5.0):
+        self.store = store
+        self.folder = folder
+        self.name = name
+        self.interval = interval
+        self.path = os.path.join(folder, f'{name}.{os.getpid()}.jsonl')
+        self.compacting_path = os.path.join(folder, f'{name}.{os.getpid()}.compacting.jsonl')
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._pending = []
+        self._compacting = []
+        self._seen = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(folder, exist_ok=True)
+        self._owner_lock = try_lock(self.path)
+        self._recover()
+        today = datetime.now().strftime('%Y-%m-%d')
+        for presence in store.list_presences(date_from=today, date_to=today):
+            if presence.get('person_id'):
+                self._seen.add((presence['person_id'], presence['date']))
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _recover(self):
+        """Verser dans le stockage les journaux laissés par des processus arrêtés (arrêt brutal).
+
+        Un journal est orphelin quand plus personne ne tient son verrou; l'ancien
+        fichier commun (presences.jsonl) est repris de la même façon.
+        """
+        pattern = re.compile(rf'^({re.escape(self.name)}(\.\d+)?)(\.compacting)?\.jsonl$')
+        bases = {match.group(1) for match in map(pattern.match, os.listdir(self.folder)) if match}
+        for base in sorted(bases):
+            path = os.path.join(self.folder, f'{base}.jsonl')
+            own = path == self.path
+            lock = self._owner_lock if own else try_lock(path)
+            if lock is None:
+                continue
+            try:
+                compacting_path = path[:-len('.jsonl')] + '.compacting.jsonl'
+                for orphan in (compacting_path, path):
+                    if os.path.exists(orphan):
+                        self._flush(read_lines(orphan))
+                        os.remove(orphan)
+            finally:
+                if not own:
+                    release_lock(lock, remove=True)
+
+    def add(self, presence):
+        """Enregistrer une présence; renvoie False si elle existe déjà pour ce jour"""
+        # Sans identifiant, pas de doublon possible: une présence ('', date) n'en masque pas d'autres
+        key = (presence.get('person_id'), presence['date']) if presence.get('person_id') else None
+        with self._lock:
+            if key in self._seen:
+                return False
+            # Réservation dans le stockage: un pointage déjà pris par un autre processus (même pas encore
+            # compacté) est refusé ici, et non écarté plus tard au compactage
+            if key and not self.store.claim_presence(*key):
+                self._seen.add(key)
+                return False
+            presence.setdefault('id', str(uuid.uuid4()))
+            try:
+                self._file.write(json.dumps(presence, ensure_ascii=False) + '\n')
+                self._file.flush()
+            except Exception:
+                if key:
+                    self.store.release_presence_claim(*key)
+                raise
+            self._pending.append(presence)
+            if key:
+                self._seen.add(key)
+        return True
+
+    def pending(self, person_id=None, date_from=None, date_to=None):
+        """Présences pas encore compactées dans le stockage, avec les mêmes filtres"""
+        with self._lock:
+            presences = self._compacting + self._pending
+        return [p for p in presences
+                if (not person_id or p.get('person_id') == person_id)
+                and (not date_from or p['date'] >= date_from)
+                and (not date_to or p['date'] <= date_to)]
+
+    def compact(self):
+        """Verser les présences en attente dans le stockage et les segments datés"""
+        with self._compact_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                # Le journal courant est mis de côté: les nouveaux pointages partent dans un fichier neuf
+                self._file.close()
+                os.replace(self.path, self.compacting_path)
+                self._file = open(self.path, 'a', encoding='utf-8')
+                batch, self._pending = self._pending, []
+                self._compacting = batch
+
+            try:
+                self._flush(batch)
+            except Exception:
+                # Échec: les présences retournent dans le journal courant pour la prochaine compaction
+                with self._lock:
+                    self._file.writelines(json.dumps(p, ensure_ascii=False) + '\n' for p in batch)
+                    self._file.flush()
+                    self._pending = batch + self._pending
+                    self._compacting = []
+                os.remove(self.compacting_path)
+                raise
+            os.remove(self.compacting_path)
+            with self._lock:
+                self._compacting = []
+                # Les jours passés sont désormais vérifiés par l'index du stockage
+                today = datetime.now().strftime('%Y-%m-%d')
+                self._seen = {key for key in self._seen if key[1] >= today}
+            self.store.prune_presence_claims(today)
+            return len(batch)
+
+    def _flush(self, batch):
+        self.store.add_presences(batch)
+        segments = defaultdict(list)
+        for presence in batch:
+            segments[presence['date']].append(presence)
+        for date, presences in segments.items():
+            with open(os.path.join(self.folder, f'{self.name}-{date}.jsonl'), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(p, ensure_ascii=False) + '\n' for p in presences)
+
+    def start(self):
+        """Démarrer la compaction périodique en arrière-plan"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Erreur lors de la compaction du journal: {e}")
+
+    def close(self):
+        """Arrêter la compaction et vider le journal"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.compact()
+        with self._lock:
+            self._file.close()
+        if os.path.exists(self.path) and not os.path.getsize(self.path):
+            os.remove(self.path)
+        if self._owner_lock is not None:
+            release_lock(self._owner_lock, remove=True)
+            self._owner_lock = None
+
+
+def read_lines(path):
+    """Lire un fichier JSON lines en ignorant une éventuelle dernière ligne tronquée"""
+    items = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    print(f"⚠️ Ligne ignorée dans {path}")
+    return items
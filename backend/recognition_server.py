@@ -0,0 +1,247 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from camera_pipeline import LatencyStats, put_latest
+from face_detection import detect_faces as detect_with, detection_params, env_detection_params
+from face_tracker import FaceTracker
+from gallery import FaceGallery
+from journal import PresenceJournal
+from store import Store
+
+
+# Détection des flux vidéo (image déjà réduite à frame_scale): HOG, un suréchantillonnage, une seule échelle
+VIDEO_DETECTION = {'model': 'hog', 'upsample': 1, 'ladder': [1.0]}
+
+
+def detect_faces(rgb_frame, detection=None):
+    return detect_with(rgb_frame, **(detection or VIDEO_DETECTION))
+
+
+def identify_faces(gallery, rgb_frame, face_locations):
+    """Encodage et comparaison des visages détectés: (person_id, nom, distance) par visage"""
+    import face_recognition
+    face_encodings = face_recognition.face_encodings(rgb_frame, known_face_locations=face_locations)
+    identities = []
+    for candidates in gallery.search_many(face_encodings, k=1):
+        if candidates and candidates[0][1] and candidates[0][2] <= gallery.tolerance:
+            identities.append(candidates[0])
+        else:
+            identities.append((None, "Inconnu", candidates[0][2] if candidates else None))
+    return identities
+
+
+def parse_source(source):
+    """'0' -> index de caméra, sinon chemin de fichier ou URL (rtsp://, http://)"""
+    return int(source) if source.isdigit() else source
+
+
+class Camera:
+    """Une source vidéo: son thread de capture, sa file d'images et son propre suivi des visages"""
+
+    def __init__(self, name, source, tracker, queue_size=2):
+        self.name = name
+        self.source = source
+        self.tracker = tracker
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        # Un fichier vidéo est lu à sa cadence d'origine, comme une vraie caméra
+        self.realtime = isinstance(source, str) and os.path.exists(source)
+
+
+class RecognitionServer:
+    """Serveur de reconnaissance sans interface pour plusieurs caméras.
+
+    Chaque source a son thread de capture; toutes alimentent un même pool de
+    workers de détection/encodage et une seule galerie en mémoire. Les
+    pointages sont écrits dans le journal des présences, une fois par
+    personne et par jour, quelle que soit l'entrée.
+    """
+
+    def __init__(self, sources, gallery, store, journal, workers=2, frame_scale=0.25,
+                 redetect_every=10, max_frame_age=0.5, refresh_interval=5.0, detection=None):
+        self.gallery = gallery
+        self.store = store
+        self.journal = journal
+        self.workers = workers
+        self.frame_scale = frame_scale
+        self.detection = detection or VIDEO_DETECTION
+        self.max_frame_age = max_frame_age
+        self.refresh_interval = refresh_interval
+        self.stats = LatencyStats()
+        self.cameras = [
+            Camera(str(source), source,
+                   FaceTracker(lambda rgb: detect_faces(rgb, self.detection),
+                               lambda rgb, boxes: identify_faces(self.gallery, rgb, boxes),
+                               redetect_every=redetect_every))
+            for source in sources
+        ]
+        self._ready = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.gallery.refresh()
+        self._threads = [threading.Thread(target=self._capture_loop, args=(camera,), daemon=True)
+                         for camera in self.cameras]
+        self._threads += [threading.Thread(target=self._worker_loop, daemon=True) for _ in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._refresh_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._ready:
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def finished(self):
+        return all(camera.finished.is_set() and camera.frames.empty() for camera in self.cameras)
+
+    def _capture_loop(self, camera):
+        capture = cv2.VideoCapture(camera.source)
+        if not capture.isOpened():
+            print(f"❌ Source vidéo inaccessible: {camera.name}")
+            camera.finished.set()
+            return
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        delay = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 25) if camera.realtime else 0
+        frame_id = 0
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                ret, frame = capture.read()
+                if not ret:
+                    print(f"❌ Fin ou erreur de la source vidéo {camera.name}")
+                    break
+                self.stats.record('capture', time.perf_counter() - start)
+                dropped = put_latest(camera.frames, (frame_id, time.monotonic(), frame))
+                if dropped:
+                    self.stats.count('dropped_queue', dropped)
+                with self._ready:
+                    self._ready.notify()
+                frame_id += 1
+                if delay:
+                    time.sleep(max(0.0, delay - (time.perf_counter() - start)))
+        finally:
+            capture.release()
+            camera.finished.set()
+
+    def _next_frame(self, start_at):
+        """Prochaine image disponible, en tournant sur les caméras pour n'en affamer aucune"""
+        count = len(self.cameras)
+        for offset in range(count):
+            camera = self.cameras[(start_at + offset) % count]
+            # Le suivi d'une caméra est séquentiel: on passe si un autre worker la traite déjà
+            if not camera.lock.acquire(blocking=False):
+                continue
+            try:
+                return camera, camera.frames.get_nowait()
+            except queue.Empty:
+                camera.lock.release()
+        return None, None
+
+    def _worker_loop(self):
+        turn = 0
+        while not self._stop.is_set():
+            camera, item = self._next_frame(turn)
+            turn += 1
+            if camera is None:
+                if self.finished():
+                    break
+                with self._ready:
+                    self._ready.wait(timeout=0.1)
+                continue
+            try:
+                self._process(camera, *item)
+            except Exception as e:
+                print(f"❌ Erreur de reconnaissance ({camera.name}): {str(e)}")
+            finally:
+                camera.lock.release()
+
+    def _process(self, camera, frame_id, captured_at, frame):
+        wait = time.monotonic() - captured_at
+        self.stats.record('queue', wait)
+        if wait > self.max_frame_age:
+            self.stats.count('dropped_stale')
+            return
+        start = time.perf_counter()
+        small_frame = cv2.resize(frame, (0, 0), fx=self.frame_scale, fy=self.frame_scale)
+        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+        for track in camera.tracker.update(rgb_small_frame, self.stats.record):
+            if track.identified:
+                self._mark(track.person_id, track.name, camera.name)
+        self.stats.record('process', time.perf_counter() - start)
+        self.stats.record('end_to_end', time.monotonic() - captured_at)
+
+    def _mark(self, person_id, name, camera_name):
+        person = self.store.get_person(person_id)
+        if person is None or not person.get('active', True):
+            return
+        now = datetime.now()
+        added = self.journal.add({
+            'nom': name,
+            'date': now.strftime('%Y-%m-%d'),
+            'heure': now.strftime('%H:%M:%S'),
+            'image': person.get('image', ''),
+            'person_id': person_id,
+            'camera': camera_name,
+        })
+        if added:
+            print(f"✅ Présence de {name} ({camera_name})")
+
+    def _refresh_loop(self):
+        # La galerie est partagée avec l'API: on suit ses modifications sur le disque
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if self.gallery.refresh():
+                    print(f"🔄 Galerie rechargée: {len(self.gallery)} visage(s)")
+            except Exception as e:
+                print(f"Erreur lors du rechargement de la galerie: {e}")
+
+
+if __name__ == '__main__':
+    # Exemple: python recognition_server.py 0 entree_nord.mp4 rtsp://camera-sud/stream
+    parser = argparse.ArgumentParser(description="Reconnaissance faciale multi-caméras sans interface")
+    parser.add_argument('sources', nargs='+', help="Index de caméra, fichier vidéo ou URL")
+    parser.add_argument('--data', default='data', help="Dossier des données (pointage.db, gallery.bin)")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PIPELINE_WORKERS', 2)))
+    parser.add_argument('--scale', type=float, default=float(os.environ.get('FRAME_SCALE', 0.25)))
+    parser.add_argument('--redetect-every', type=int, default=int(os.environ.get('REDETECT_EVERY', 10)))
+    parser.add_argument('--detector', help="hog, cnn, haar ou dnn (défaut: FACE_DETECTOR ou hog)")
+    parser.add_argument('--upsample', type=int, help="Suréchantillonnages avant détection (défaut: FACE_UPSAMPLE ou 1)")
+    parser.add_argument('--ladder', help="Échelles essayées, ex. 0.5,1 (défaut: DETECTION_LADDER ou 1)")
+    args = parser.parse_args()
+    detection = detection_params(env_detection_params(VIDEO_DETECTION), args.detector, args.upsample, args.ladder)
+
+    store = Store(os.path.join(args.data, 'pointage.db'))
+    journal = PresenceJournal(store, os.path.join(args.data, 'journal'), name='server')
+    journal.start()
+    gallery = FaceGallery(os.path.join(args.data, 'gallery.bin'), index=os.environ.get('GALLERY_INDEX', 'flat'))
+    server = RecognitionServer([parse_source(s) for s in args.sources], gallery, store, journal,
+                               workers=args.workers, frame_scale=args.scale, redetect_every=args.redetect_every,
+                               detection=detection)
+    server.start()
+    print(f"🎥 Reconnaissance démarrée sur {len(server.cameras)} source(s). Ctrl+C pour arrêter.")
+    last_stats = time.monotonic()
+    try:
+        while not server.finished():
+            time.sleep(1)
+            if time.monotonic() - last_stats > 30:
+                print(f"⏱️ Latences: {server.stats.snapshot()}")
+                last_stats = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        journal.close()
+        print(f"⏱️ Latences: {server.stats.snapshot()}")
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from encoding_cache import detect_and_encode
+from gallery import FaceGallery
+
+# État propre à chaque processus du pool: chargé une fois, réutilisé par toutes les requêtes
+_gallery = None
+
+
+def default_workers():
+    """Taille par défaut d'un pool de processus: les CPU partagés entre les workers gunicorn (WEB_CONCURRENCY)"""
+    web_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+class ServiceBusy(Exception):
+    """Trop de requêtes en attente: le client doit réessayer plus tard"""
+
+
+def _init_worker(gallery_file, tolerance, index, warm_up):
+    global _gallery
+    # Galerie chargée une fois par processus, relue seulement quand le fichier change
+    _gallery = FaceGallery(gallery_file, tolerance=tolerance, index=index)
+    _gallery.refresh()
+    if warm_up:
+        import numpy as np
+        import face_recognition
+        blank = np.zeros((160, 160, 3), dtype=np.uint8)
+        face_recognition.face_locations(blank)
+        face_recognition.face_encodings(blank, known_face_locations=[(20, 140, 140, 20)])
+
+
+def _ping(delay):
+    # Tâche vide: force le démarrage (et donc l'initialisation) d'un processus du pool
+    time.sleep(delay)
+    return os.getpid()
+
+
+def recognize_image(content, k=1, all_faces=False, params=None):
+    """Détecter, encoder et identifier les visages d'une image (exécuté dans un processus du pool).
+
+    Renvoie une liste de visages: boîte, meilleur candidat et, si k > 1, les
+    k plus proches voisins.
+    """
+    params = dict(params or {}, all_faces=all_faces)
+    _, boxes, encodings, _ = detect_and_encode(content, params=params)
+    if not encodings:
+        return []
+    _gallery.refresh()
+    faces = []
+    for (top, right, bottom, left), candidates in zip(boxes, _gallery.search_many(encodings, k)):
+        best = candidates[0] if candidates else None
+        recognized = best is not None and bool(best[1]) and best[2] <= _gallery.tolerance
+        face = {
+            'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+            'recognized': recognized,
+            'name': best[1] if recognized else "Inconnu",
+            'person_id': best[0] if recognized else None,
+            'distance': best[2] if best else None,
+        }
+        if k > 1:
+            face['candidates'] = [{'person_id': person_id, 'name': name, 'distance': distance}
+                                  for person_id, name, distance in candidates]
+        faces.append(face)
+    return faces
+
+
+def detect_frame(rgb, detection):
+    """Boîtes des visages d'une image déjà décodée (suivi des flux, exécuté dans un processus du pool)"""
+    from face_detection import detect_faces
+    return detect_faces(rgb, **detection)
+
+
+def identify_frame(rgb, boxes):
+    """Identité (person_id, nom, distance) de chaque boîte (suivi des flux, exécuté dans un processus du pool)"""
+    from recognition_server import identify_faces
+    _gallery.refresh()
+    return identify_faces(_gallery, rgb, boxes)
+
+
+class RecognitionService:
+    """Pool de processus de reconnaissance derrière l'API.
+
+    Les modèles et la galerie sont chargés une fois par processus; les
+    requêtes Flask ne font qu'envoyer l'image et attendre le résultat, sans
+    tenir le GIL pendant les calculs dlib. Au-delà de `max_pending` requêtes
+    en cours, `submit` lève ServiceBusy (l'API répond 503) plutôt que
+    d'empiler une attente sans fin; `call` abandonne après `timeout` secondes.
+    """
+
+    def __init__(self, gallery_file, workers=None, max_pending=None, timeout=10.0,
+                 tolerance=0.6, index='flat', warm_up=False):
+        self.gallery_file = gallery_file
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or 4 * self.workers
+        self.timeout = timeout
+        self._initargs = (gallery_file, tolerance, index, warm_up)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0,
+                       'max_pending_seen': 0}
+        self._latency_ms = None
+
+    def _get_pool(self):
+        # Créé à la première requête: les workers CRUD ne démarrent jamais de processus
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=self._initargs)
+        return self._pool
+
+    def start(self):
+        """Démarrer tous les processus du pool (préchauffage): chacun charge la galerie et les modèles"""
+        with self._lock:
+            pool = self._get_pool()
+        # Une tâche vide par processus, jusqu'à ce que chacun ait répondu (donc fini de s'initialiser)
+        pids = set()
+        for _ in range(10):
+            pids |= {future.result() for future in [pool.submit(_ping, 0.05) for _ in range(self.workers)]}
+            if len(pids) >= self.workers:
+                break
+        return len(pids)
+
+    def submit(self, fn, *args):
+        """Envoyer une tâche au pool; lève ServiceBusy si la file est pleine"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise ServiceBusy(f"{self._pending} requête(s) de reconnaissance en attente")
+            try:
+                future = self._get_pool().submit(fn, *args)
+            except BrokenProcessPool:
+                # Un processus a été tué (mémoire, signal): on repart sur un pool neuf
+                print("⚠️ Pool de reconnaissance cassé, redémarrage")
+                self._pool = None
+                future = self._get_pool().submit(fn, *args)
+            self._pending += 1
+            self._stats['submitted'] += 1
+            self._stats['max_pending_seen'] = max(self._stats['max_pending_seen'], self._pending)
+        started = time.perf_counter()
+        future.add_done_callback(lambda f: self._done(f, started))
+        return future
+
+    def _done(self, future, started):
+        ms = (time.perf_counter() - started) * 1000.0
+        with self._lock:
+            self._pending -= 1
+            failed = future.cancelled() or future.exception() is not None
+            self._stats['failed' if failed else 'completed'] += 1
+            self._latency_ms = ms if self._latency_ms is None else self._latency_ms + 0.1 * (ms - self._latency_ms)
+
+    def call(self, fn, *args, timeout=None):
+        """Exécuter une tâche et attendre son résultat (TimeoutError après le délai)"""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            # La tâche continue dans son processus et occupe sa place jusqu'à la fin
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError("Délai de reconnaissance dépassé")
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._stats,
+                        pending=self._pending,
+                        max_pending=self.max_pending,
+                        workers=self.workers,
+                        started=self._pool is not None,
+                        avg_latency_ms=round(self._latency_ms, 1) if self._latency_ms is not None else None)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,257 @@
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+# Poids des champs dans le classement
+FIELD_WEIGHTS = {'nom': 4.0, 'email': 2.0, 'poste': 1.0, 'departement': 1.0}
+EXACT, PREFIX = 3.0, 2.0
+MIN_SIMILARITY = 0.4
+MAX_EXPANSIONS = 500
+# Trigrammes partagés par trop de mots (début d'email, etc.): ignorés pour la tolérance aux fautes
+MAX_TRIGRAM_TOKENS = 2000
+# Au-delà, un groupe de résultats est départagé en parcourant les noms déjà triés
+SMALL_GROUP = 2000
+
+
+def normalize(text):
+    """Minuscules sans accents: 'Hélène Françoise' -> 'helene francoise'"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [t for t in re.split(r'[^a-z0-9]+', normalize(text)) if t]
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PersonSearchIndex:
+    """Index de recherche des personnes (nom, email, poste, département).
+
+    Index inversé mot -> personnes, liste triée des mots pour les recherches
+    par préfixe et index des trigrammes pour tolérer les fautes de frappe.
+    Les textes sont comparés sans accents ni majuscules. L'index est mis à
+    jour personne par personne; il est reconstruit si la table des personnes
+    a été modifiée par un autre processus (version du stockage).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.version = None
+        self._lock = threading.Lock()
+        self._persons = {}
+        self._postings = defaultdict(dict)   # mot -> {person_id: poids du meilleur champ}
+        self._tokens = []                     # mots triés (préfixes)
+        self._trigrams = defaultdict(set)     # trigramme -> mots
+        self._sort_names = {}                 # person_id -> nom normalisé (départage)
+        self._ordered = []                    # (nom normalisé, person_id) triés
+        self._weighted = defaultdict(lambda: defaultdict(set))  # mot -> poids -> personnes
+
+    def refresh(self):
+        """Reconstruire l'index si la table des personnes a changé hors de ce processus"""
+        version = self.store.table_version('persons')
+        if version == self.version:
+            return False
+        persons = self.store.list_persons()
+        with self._lock:
+            self._persons.clear()
+            self._postings.clear()
+            self._tokens = []
+            self._trigrams.clear()
+            self._sort_names.clear()
+            self._weighted.clear()
+            self._ordered = []
+            for person in persons:
+                self._add(person, ordered=False)
+            self._ordered = sorted((name, pid) for pid, name in self._sort_names.items())
+            self.version = version
+        return True
+
+    def updated(self, version_before, person=None, removed_id=None):
+        """Appliquer une écriture faite par ce processus (une seule ligne modifiée).
+
+        Si d'autres écritures ont eu lieu entre-temps, l'index est reconstruit.
+        """
+        if self.version != version_before or self.store.table_version('persons') != version_before + 1:
+            self.refresh()
+            return
+        with self._lock:
+            person_id = removed_id or person['id']
+            self._remove(person_id)
+            if person is not None:
+                self._add(person)
+            self.version = version_before + 1
+
+    def _add(self, person, ordered=True):
+        person_id = person['id']
+        self._persons[person_id] = person
+        self._sort_names[person_id] = normalize(person.get('nom'))
+        if ordered:
+            bisect.insort(self._ordered, (self._sort_names[person_id], person_id))
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(person.get(field)):
+                postings = self._postings[token]
+                if not postings:
+                    bisect.insort(self._tokens, token)
+                    for trigram in trigrams(token):
+                        self._trigrams[trigram].add(token)
+                previous = postings.get(person_id, 0.0)
+                if weight > previous:
+                    if previous:
+                        self._weighted[token][previous].discard(person_id)
+                    self._weighted[token][weight].add(person_id)
+                    postings[person_id] = weight
+
+    def _remove(self, person_id):
+        person = self._persons.pop(person_id, None)
+        if person is None:
+            return
+        name = self._sort_names.pop(person_id)
+        del self._ordered[bisect.bisect_left(self._ordered, (name, person_id))]
+        for field in FIELD_WEIGHTS:
+            for token in tokenize(person.get(field)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                weight = postings.pop(person_id, None)
+                if weight is None:
+                    continue
+                self._weighted[token][weight].discard(person_id)
+                if postings:
+                    continue
+                del self._postings[token]
+                del self._weighted[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+
+    def _term_scores(self, term, candidates=None, limit=20):
+        """Score de chaque personne pour un mot de la requête: exact > préfixe > trigrammes.
+
+        Avec `candidates`, seules ces personnes sont notées (mots suivants de
+        la requête). Les trigrammes ne servent que si exact et préfixe ne
+        donnent pas assez de résultats.
+        """
+        scores = {}
+
+        def credit(token, factor):
+            postings = self._postings.get(token)
+            if not postings:
+                return
+            if candidates is None and not scores:
+                scores.update({pid: factor * weight for pid, weight in postings.items()})
+                return
+            if candidates is not None and len(candidates) < len(postings):
+                matches = ((pid, postings[pid]) for pid in candidates if pid in postings)
+            else:
+                matches = postings.items()
+                if candidates is not None:
+                    matches = ((pid, w) for pid, w in matches if pid in candidates)
+            for person_id, weight in matches:
+                score = factor * weight
+                if score > scores.get(person_id, 0.0):
+                    scores[person_id] = score
+
+        credit(term, EXACT)
+        start = bisect.bisect_left(self._tokens, term)
+        for token in self._tokens[start:start + MAX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            if token != term:
+                credit(token, PREFIX)
+
+        if len(term) >= 3 and len(scores) < limit:
+            term_trigrams = trigrams(term)
+            shared = defaultdict(int)
+            for trigram in term_trigrams:
+                tokens = self._trigrams.get(trigram, ())
+                if len(tokens) > MAX_TRIGRAM_TOKENS:
+                    continue
+                for token in tokens:
+                    shared[token] += 1
+            # Dice: un trigramme par caractère du mot, plus un pour l'espace de fin
+            needed = MIN_SIMILARITY * len(term_trigrams) / 2.0
+            for token, count in shared.items():
+                if count < needed:
+                    continue
+                similarity = 2.0 * count / (len(term_trigrams) + len(token) + 1)
+                if similarity >= MIN_SIMILARITY and token != term and not token.startswith(term):
+                    credit(token, similarity)
+        return scores
+
+    def search(self, query, limit=20):
+        """Personnes correspondant à tous les mots de la requête, les plus pertinentes d'abord"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            if len(terms) == 1:
+                ranked = self._search_single(terms[0], limit)
+                if len(ranked) >= limit:
+                    return [dict(self._persons[pid], score=score) for pid, score in ranked]
+            # Les mots les plus longs sont en général les plus sélectifs
+            total = None
+            for term in sorted(terms, key=len, reverse=True):
+                scores = self._term_scores(term, total, limit)
+                if total is None:
+                    total = scores
+                else:
+                    total = {pid: total[pid] + score for pid, score in scores.items()}
+                if not total:
+                    return []
+            # Peu de scores distincts: on prend les groupes du meilleur score, départagés par nom
+            by_score = defaultdict(list)
+            for pid, score in total.items():
+                by_score[score].append(pid)
+            ranked = []
+            for score in sorted(by_score, reverse=True):
+                group = heapq.nsmallest(limit - len(ranked), by_score[score], key=self._sort_names.__getitem__)
+                ranked += [(pid, score) for pid in group]
+                if len(ranked) >= limit:
+                    break
+            return [dict(self._persons[pid], score=round(score, 3)) for pid, score in ranked]
+
+    def _search_single(self, term, limit):
+        """Requête d'un seul mot (saisie en cours): les groupes de score sont parcourus du meilleur
+        au moins bon sans noter toutes les personnes, même pour un mot très fréquent."""
+        start = bisect.bisect_left(self._tokens, term)
+        prefixed = []
+        for token in self._tokens[start:start + MAX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            if token != term:
+                prefixed.append(token)
+
+        groups = []
+        for weight in sorted(set(FIELD_WEIGHTS.values()), reverse=True):
+            groups.append((EXACT * weight, [term] if term in self._weighted else [], weight))
+            groups.append((PREFIX * weight, prefixed, weight))
+        groups.sort(key=lambda group: -group[0])
+
+        ranked, seen = [], set()
+        for score, tokens, weight in groups:
+            sets = [self._weighted[token][weight] for token in tokens if weight in self._weighted[token]]
+            pool = set().union(*sets) - seen if sets else set()
+            if not pool:
+                continue
+            needed = limit - len(ranked)
+            if len(pool) <= SMALL_GROUP:
+                group = heapq.nsmallest(needed, pool, key=self._sort_names.__getitem__)
+            else:
+                group = []
+                for _, pid in self._ordered:
+                    if pid in pool:
+                        group.append(pid)
+                        if len(group) == needed:
+                            break
+            ranked += [(pid, score) for pid in group]
+            seen |= pool
+            if len(ranked) >= limit:
+                break
+        return ranked
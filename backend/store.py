@@ -0,0 +1,631 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+PERSON_FIELDS = ['id', 'nom', 'email', 'telephone', 'poste', 'departement', 'image',
+                 'date_creation', 'date_modification', 'active']
+PRESENCE_FIELDS = ['id', 'person_id', 'nom', 'date', 'heure', 'image', 'timestamp']
+ABSENT_FIELDS = ['id', 'nom', 'email', 'telephone', 'image', 'poste', 'departement', 'date', 'raison']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persons (
+    id TEXT PRIMARY KEY,
+    nom TEXT NOT NULL,
+    email TEXT,
+    telephone TEXT,
+    poste TEXT,
+    departement TEXT,
+    image TEXT,
+    date_creation TEXT,
+    date_modification TEXT,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_persons_email ON persons(email);
+CREATE INDEX IF NOT EXISTS idx_persons_nom ON persons(nom);
+
+CREATE TABLE IF NOT EXISTS presences (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    person_id TEXT,
+    nom TEXT,
+    date TEXT NOT NULL,
+    heure TEXT,
+    image TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_presences_date ON presences(date);
+CREATE INDEX IF NOT EXISTS idx_presences_id ON presences(id);
+
+CREATE TABLE IF NOT EXISTS absents (
+    id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    nom TEXT,
+    email TEXT,
+    telephone TEXT,
+    image TEXT,
+    poste TEXT,
+    departement TEXT,
+    raison TEXT,
+    PRIMARY KEY (id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_absents_date ON absents(date);
+
+-- Agrégats tenus à jour à chaque présence (tableau de bord sans parcourir tout l'historique)
+CREATE TABLE IF NOT EXISTS stats_hourly (
+    date TEXT NOT NULL,
+    departement TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    first_heure TEXT,
+    last_heure TEXT,
+    PRIMARY KEY (date, departement, hour)
+);
+
+CREATE TABLE IF NOT EXISTS stats_persons (
+    person_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    first_date TEXT,
+    last_date TEXT,
+    last_heure TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Tâches d'enrôlement et captures en attente, partagées par tous les workers de l'API
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    filename TEXT,
+    submitted REAL NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs(filename);
+CREATE INDEX IF NOT EXISTS idx_jobs_submitted ON jobs(submitted);
+
+-- Pointages du jour réservés par les journaux de tous les processus, avant leur compactage
+CREATE TABLE IF NOT EXISTS presence_claims (
+    person_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (person_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS staged_captures (
+    filename TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    score REAL NOT NULL,
+    encoding BLOB NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (filename, position)
+);
+"""
+
+# Tables exposées par les routes de liste: numéro de version (ETag) et colonnes triables
+VERSIONED_TABLES = ('persons', 'presences', 'absents')
+SORTABLE_FIELDS = {
+    'persons': ['nom', 'email', 'poste', 'departement', 'date_creation', 'date_modification'],
+    'presences': ['date', 'heure', 'nom'],
+    'absents': ['nom', 'departement', 'poste'],
+}
+
+# Chaque écriture incrémente la version de sa table, sans toucher au code des écritures
+for _table in VERSIONED_TABLES:
+    for _event in ('INSERT', 'UPDATE', 'DELETE'):
+        SCHEMA += f"""
+CREATE TRIGGER IF NOT EXISTS {_table}_version_{_event.lower()} AFTER {_event} ON {_table}
+BEGIN
+    INSERT INTO meta (key, value) VALUES ('version:{_table}', 1)
+    ON CONFLICT (key) DO UPDATE SET value = value + 1;
+END;
+"""
+
+SCHEMA += """
+CREATE INDEX IF NOT EXISTS idx_presences_date_heure ON presences(date, heure);
+CREATE INDEX IF NOT EXISTS idx_persons_departement ON persons(departement);
+"""
+
+
+def _to_dict(row, fields):
+    """Convertir une ligne SQLite au format JSON historique (sans les champs vides)"""
+    item = {field: row[field] for field in fields if row[field] is not None}
+    if 'active' in item:
+        item['active'] = bool(item['active'])
+    return item
+
+
+class Store:
+    """Stockage SQLite des personnes, présences et absences.
+
+    Remplace les fichiers personnes.json, presence.json et absent.json: chaque
+    écriture ne touche que les lignes concernées, et les recherches par
+    person_id, email et date passent par des index.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._totals = {}
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._migrate_unique_presences()
+        if not self.get_meta('stats_built'):
+            self.rebuild_stats()
+
+    def _migrate_unique_presences(self):
+        """Une présence par personne et par jour, garantie par un index unique (partagé par tous les processus).
+
+        Les doublons déjà enregistrés sont supprimés (la plus ancienne est
+        gardée) et les agrégats recalculés.
+        """
+        if self.get_meta('presences_unique'):
+            return
+        with self._connect() as conn:
+            conn.execute("UPDATE presences SET person_id = NULL WHERE person_id = ''")
+            removed = conn.execute(
+                """DELETE FROM presences WHERE person_id IS NOT NULL AND seq NOT IN (
+                       SELECT MIN(seq) FROM presences WHERE person_id IS NOT NULL GROUP BY person_id, date)"""
+            ).rowcount
+            conn.execute('DROP INDEX IF EXISTS idx_presences_person_date')
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_presences_person_date_unique ON presences(person_id, date)')
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('presences_unique', '1')")
+            if removed:
+                print(f"⚠️ {removed} présence(s) en double supprimée(s)")
+                conn.execute("DELETE FROM meta WHERE key = 'stats_built'")
+
+    def _connect(self):
+        """Connexion propre au thread courant (le serveur Flask est multi-thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Personnes
+    def list_persons(self):
+        rows = self._connect().execute('SELECT * FROM persons ORDER BY rowid').fetchall()
+        return [_to_dict(row, PERSON_FIELDS) for row in rows]
+
+    def get_person(self, person_id):
+        row = self._connect().execute('SELECT * FROM persons WHERE id = ?', (person_id,)).fetchone()
+        return _to_dict(row, PERSON_FIELDS) if row else None
+
+    def find_person_by_email(self, email):
+        row = self._connect().execute('SELECT * FROM persons WHERE email = ?', (email,)).fetchone()
+        return _to_dict(row, PERSON_FIELDS) if row else None
+
+    def add_person(self, person):
+        with self._connect() as conn:
+            self._insert(conn, 'persons', PERSON_FIELDS, person)
+            self._sync_absent(conn, person['id'])
+        return person
+
+    def update_person(self, person_id, fields):
+        """Mettre à jour certains champs d'une personne, renvoie la personne ou None"""
+        fields = {k: v for k, v in fields.items() if k in PERSON_FIELDS and k != 'id'}
+        if fields:
+            assignments = ', '.join(f'{k} = ?' for k in fields)
+            with self._connect() as conn:
+                conn.execute(f'UPDATE persons SET {assignments} WHERE id = ?',
+                             [self._value(k, v) for k, v in fields.items()] + [person_id])
+                self._sync_absent(conn, person_id)
+        return self.get_person(person_id)
+
+    def delete_person(self, person_id):
+        with self._connect() as conn:
+            deleted = conn.execute('DELETE FROM persons WHERE id = ?', (person_id,)).rowcount > 0
+            self._sync_absent(conn, person_id)
+            return deleted
+
+    def count_persons(self, active_only=False):
+        query = 'SELECT COUNT(*) FROM persons' + (' WHERE active = 1' if active_only else '')
+        return self._connect().execute(query).fetchone()[0]
+
+    # Présences
+    def list_presences(self, person_id=None, date_from=None, date_to=None, newest_first=False):
+        clauses, params = [], []
+        if person_id:
+            clauses.append('person_id = ?')
+            params.append(person_id)
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('date <= ?')
+            params.append(date_to)
+        query = 'SELECT * FROM presences'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY date DESC, seq DESC' if newest_first else ' ORDER BY seq'
+        rows = self._connect().execute(query, params).fetchall()
+        return [_to_dict(row, PRESENCE_FIELDS) for row in rows]
+
+    def add_presences(self, presences):
+        """Insérer un lot de présences en une transaction (id déjà présents et doublons du jour ignorés)"""
+        with self._connect() as conn:
+            for presence in presences:
+                if presence.get('id') and conn.execute(
+                    'SELECT 1 FROM presences WHERE id = ? LIMIT 1', (presence['id'],)
+                ).fetchone():
+                    continue
+                if not self._insert(conn, 'presences', PRESENCE_FIELDS, self._presence_row(presence),
+                                    conflict='IGNORE'):
+                    continue
+                self._count_presence(conn, presence)
+                self._mark_present(conn, presence)
+
+    def claim_presence(self, person_id, date):
+        """Réserver le pointage (personne, jour) pour tous les processus; False s'il est déjà pris"""
+        with self._connect() as conn:
+            if conn.execute('SELECT 1 FROM presences WHERE person_id = ? AND date = ? LIMIT 1',
+                            (person_id, date)).fetchone():
+                return False
+            return conn.execute('INSERT OR IGNORE INTO presence_claims (person_id, date) VALUES (?, ?)',
+                                (person_id, date)).rowcount > 0
+
+    def release_presence_claim(self, person_id, date):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM presence_claims WHERE person_id = ? AND date = ?', (person_id, date))
+
+    def prune_presence_claims(self, before):
+        """Oublier les réservations des jours passés (les présences compactées portent l'index unique)"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM presence_claims WHERE date < ?', (before,))
+
+    @staticmethod
+    def _presence_row(presence):
+        # Sans personne connue, pas de contrôle de doublon (NULL n'entre pas dans l'index unique)
+        if not presence.get('person_id'):
+            return {field: value for field, value in presence.items() if field != 'person_id'}
+        return presence
+
+    def count_presences(self, date_from=None, date=None):
+        """Nombre de présences, lu dans les agrégats horaires (quelques lignes par jour) plutôt qu'un COUNT(*)"""
+        if date:
+            query, params = 'SELECT SUM(count) FROM stats_hourly WHERE date = ?', (date,)
+        elif date_from:
+            query, params = 'SELECT SUM(count) FROM stats_hourly WHERE date >= ?', (date_from,)
+        else:
+            query, params = 'SELECT SUM(count) FROM stats_hourly', ()
+        return self._connect().execute(query, params).fetchone()[0] or 0
+
+    # Statistiques
+    def _departement(self, conn, person_id):
+        row = conn.execute('SELECT departement FROM persons WHERE id = ?', (person_id,)).fetchone()
+        return (row[0] if row else None) or ''
+
+    def _count_presence(self, conn, presence):
+        """Répercuter une nouvelle présence dans les agrégats (même transaction que l'insertion)"""
+        heure = presence.get('heure') or ''
+        hour = int(heure[:2]) if heure[:2].isdigit() else -1
+        conn.execute(
+            """INSERT INTO stats_hourly (date, departement, hour, count, first_heure, last_heure)
+               VALUES (?, ?, ?, 1, ?, ?)
+               ON CONFLICT (date, departement, hour) DO UPDATE SET
+                   count = count + 1,
+                   first_heure = MIN(COALESCE(first_heure, excluded.first_heure), excluded.first_heure),
+                   last_heure = MAX(COALESCE(last_heure, excluded.last_heure), excluded.last_heure)""",
+            (presence['date'], self._departement(conn, presence.get('person_id')), hour, heure or None, heure or None),
+        )
+        if presence.get('person_id'):
+            conn.execute(
+                """INSERT INTO stats_persons (person_id, count, first_date, last_date, last_heure)
+                   VALUES (?, 1, ?, ?, ?)
+                   ON CONFLICT (person_id) DO UPDATE SET
+                       count = count + 1,
+                       first_date = MIN(first_date, excluded.first_date),
+                       last_heure = CASE WHEN excluded.last_date >= last_date THEN excluded.last_heure ELSE last_heure END,
+                       last_date = MAX(last_date, excluded.last_date)""",
+                (presence['person_id'], presence['date'], presence['date'], heure or None),
+            )
+
+    def rebuild_stats(self):
+        """Recalculer les agrégats depuis toutes les présences (base existante ou migration)"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stats_hourly')
+            conn.execute('DELETE FROM stats_persons')
+            for row in conn.execute('SELECT person_id, date, heure FROM presences ORDER BY seq').fetchall():
+                self._count_presence(conn, dict(row))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('stats_built', '1')")
+
+    def attendance_stats(self, date_from, date_to, group_by_departement=False, hourly=False, extra=()):
+        """Présences par jour sur une période, avec premières/dernières heures d'arrivée.
+
+        Le coût dépend du nombre de jours de la période, pas de l'historique.
+        `extra` ajoute des présences pas encore enregistrées (journal).
+        """
+        rows = [dict(row) for row in self._connect().execute(
+            'SELECT * FROM stats_hourly WHERE date >= ? AND date <= ?', (date_from, date_to)
+        ).fetchall()]
+        conn = self._connect()
+        for presence in extra:
+            heure = presence.get('heure') or ''
+            rows.append({'date': presence['date'], 'departement': self._departement(conn, presence.get('person_id')),
+                         'hour': int(heure[:2]) if heure[:2].isdigit() else -1, 'count': 1,
+                         'first_heure': heure or None, 'last_heure': heure or None})
+
+        def fold(groups, key, row):
+            group = groups.setdefault(key, {'count': 0, 'first_heure': None, 'last_heure': None})
+            group['count'] += row['count']
+            if row['first_heure'] and (group['first_heure'] is None or row['first_heure'] < group['first_heure']):
+                group['first_heure'] = row['first_heure']
+            if row['last_heure'] and (group['last_heure'] is None or row['last_heure'] > group['last_heure']):
+                group['last_heure'] = row['last_heure']
+
+        days, departements, hours = {}, {}, {}
+        for row in rows:
+            fold(days, row['date'], row)
+            if group_by_departement:
+                fold(departements, row['departement'] or 'Non renseigné', row)
+            if hourly and row['hour'] >= 0:
+                fold(hours, row['hour'], row)
+
+        result = {
+            'total': sum(day['count'] for day in days.values()),
+            'days': [dict(day, date=date) for date, day in sorted(days.items())],
+        }
+        if group_by_departement:
+            result['departements'] = [dict(group, departement=name) for name, group in sorted(departements.items())]
+        if hourly:
+            result['hours'] = [{'hour': hour, 'count': hours.get(hour, {}).get('count', 0)} for hour in range(24)]
+        return result
+
+    def person_stats(self, person_id):
+        row = self._connect().execute('SELECT * FROM stats_persons WHERE person_id = ?', (person_id,)).fetchone()
+        return dict(row) if row else {'person_id': person_id, 'count': 0}
+
+    # Absences
+    # Chaque journée est ouverte une fois avec toutes les personnes actives sans présence;
+    # ensuite chaque présence, ajout, modification ou suppression ne touche que sa ligne.
+    def open_absence_day(self, date):
+        """Initialiser les absents d'une journée (une seule fois); renvoie le nombre d'absents"""
+        conn = self._connect()
+        if self.get_meta(f'absents_opened:{date}') is None:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('SELECT 1 FROM meta WHERE key = ?', (f'absents_opened:{date}',)).fetchone() is None:
+                    # INSERT OR IGNORE: les raisons déjà saisies pour cette journée sont conservées
+                    conn.execute(
+                        """INSERT OR IGNORE INTO absents (id, nom, email, telephone, image, poste, departement, date)
+                           SELECT id, nom, email, telephone, COALESCE(image, ''), COALESCE(poste, ''),
+                                  COALESCE(departement, ''), ?
+                           FROM persons p
+                           WHERE active = 1 AND NOT EXISTS (
+                               SELECT 1 FROM presences WHERE person_id = p.id AND date = ?)""",
+                        (date, date),
+                    )
+                    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 (f'absents_opened:{date}', '1'))
+        return conn.execute('SELECT COUNT(*) FROM absents WHERE date = ?', (date,)).fetchone()[0]
+
+    def _mark_present(self, conn, presence):
+        if presence.get('person_id'):
+            conn.execute('DELETE FROM absents WHERE id = ? AND date = ?', (presence['person_id'], presence['date']))
+
+    def _sync_absent(self, conn, person_id):
+        """Répercuter un changement de personne sur la journée d'absences en cours"""
+        date = datetime.now().strftime('%Y-%m-%d')
+        if conn.execute('SELECT 1 FROM meta WHERE key = ?', (f'absents_opened:{date}',)).fetchone() is None:
+            return
+        person = conn.execute('SELECT * FROM persons WHERE id = ?', (person_id,)).fetchone()
+        present = conn.execute('SELECT 1 FROM presences WHERE person_id = ? AND date = ? LIMIT 1',
+                               (person_id, date)).fetchone()
+        if person is None or not person['active'] or present:
+            conn.execute('DELETE FROM absents WHERE id = ? AND date = ?', (person_id, date))
+            return
+        conn.execute(
+            """INSERT INTO absents (id, nom, email, telephone, image, poste, departement, date)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (id, date) DO UPDATE SET
+                   nom = excluded.nom, email = excluded.email, telephone = excluded.telephone,
+                   image = excluded.image, poste = excluded.poste, departement = excluded.departement""",
+            (person_id, person['nom'], person['email'], person['telephone'], person['image'] or '',
+             person['poste'] or '', person['departement'] or '', date),
+        )
+
+    def update_absent_reason(self, person_id, raison, date=None):
+        """Mettre à jour la raison d'absence (dernière journée générée par défaut)"""
+        with self._connect() as conn:
+            if date is None:
+                date = conn.execute('SELECT MAX(date) FROM absents WHERE id = ?', (person_id,)).fetchone()[0]
+            return conn.execute('UPDATE absents SET raison = ? WHERE id = ? AND date = ?',
+                                (raison, person_id, date)).rowcount > 0
+
+    # Tâches de fond (enrôlements, ré-encodage)
+    def add_job(self, job, history=1000):
+        """Enregistrer (ou relancer) une tâche; seules les `history` plus récentes terminées sont gardées"""
+        data = {k: v for k, v in job.items() if k not in ('id', 'state', 'filename')}
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO jobs (id, state, filename, submitted, data) VALUES (?, ?, ?, ?, ?)',
+                         (job['id'], job['state'], job.get('filename'), time.time(), json.dumps(data)))
+            conn.execute("""DELETE FROM jobs WHERE state NOT IN ('queued', 'running') AND id IN (
+                               SELECT id FROM jobs ORDER BY submitted DESC LIMIT -1 OFFSET ?)""", (history,))
+
+    def update_job(self, job_id, **changes):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            data = json.loads(row['data'])
+            data.update({k: v for k, v in changes.items() if k != 'state'})
+            conn.execute('UPDATE jobs SET state = COALESCE(?, state), data = ? WHERE id = ?',
+                         (changes.get('state'), json.dumps(data), job_id))
+
+    def get_job(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row['data']), id=row['id'], state=row['state'], filename=row['filename'])
+
+    def job_in_progress(self, filename, max_age=600):
+        """Vrai si une tâche récente sur ce fichier n'est pas terminée (les tâches d'un worker arrêté expirent)"""
+        row = self._connect().execute(
+            "SELECT 1 FROM jobs WHERE filename = ? AND state IN ('queued', 'running') AND submitted >= ? LIMIT 1",
+            (filename, time.time() - max_age)).fetchone()
+        return row is not None
+
+    # Captures enrôlées en attente de la création de la personne
+    def stage_capture(self, filename, score, encoding):
+        """Mettre de côté une capture; renvoie sa position dans le groupe (0 pour l'image principale)"""
+        with self._connect() as conn:
+            position = conn.execute('SELECT COUNT(*) FROM staged_captures WHERE filename = ?', (filename,)).fetchone()[0]
+            conn.execute('INSERT INTO staged_captures (filename, position, score, encoding, created) VALUES (?, ?, ?, ?, ?)',
+                         (filename, position, score, np.asarray(encoding, dtype='<f4').tobytes(), time.time()))
+        return position
+
+    def staged_captures(self, filename=None):
+        """Captures en attente: {fichier: [(score, encodage), ...]} dans l'ordre des positions"""
+        query = 'SELECT filename, score, encoding FROM staged_captures'
+        params = ()
+        if filename is not None:
+            query, params = query + ' WHERE filename = ?', (filename,)
+        captures = {}
+        for row in self._connect().execute(query + ' ORDER BY filename, position', params):
+            captures.setdefault(row['filename'], []).append(
+                (row['score'], np.frombuffer(row['encoding'], dtype='<f4').astype(np.float64)))
+        return captures
+
+    def drop_staged(self, filename):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM staged_captures WHERE filename = ?', (filename,))
+
+    def prune_staged(self, max_age):
+        """Oublier les captures dont la personne n'a pas été créée à temps; renvoie le nombre de groupes retirés"""
+        with self._connect() as conn:
+            cutoff = time.time() - max_age
+            expired = conn.execute(
+                'SELECT filename FROM staged_captures GROUP BY filename HAVING MAX(created) < ?', (cutoff,)
+            ).fetchall()
+            conn.executemany('DELETE FROM staged_captures WHERE filename = ?', [tuple(row) for row in expired])
+        return len(expired)
+
+    # Utilitaires
+    @staticmethod
+    def _value(field, value):
+        if field == 'active':
+            return 1 if value else 0
+        return value
+
+    def _insert(self, conn, table, fields, item, conflict='REPLACE'):
+        """INSERT OR REPLACE (ou OR IGNORE); renvoie vrai si une ligne a été écrite"""
+        columns = [f for f in fields if f in item]
+        cursor = conn.execute(
+            f'INSERT OR {conflict} INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+            [self._value(f, item[f]) for f in columns],
+        )
+        return cursor.rowcount > 0
+
+    def table_version(self, table):
+        """Numéro incrémenté à chaque modification de la table (pour les ETag)"""
+        return int(self.get_meta(f'version:{table}', 0))
+
+    def page(self, table, fields, filters=None, sort=None, descending=False, limit=None, after=None):
+        """Lecture paginée par curseur (keyset) d'une table.
+
+        `filters` est une liste de (colonne, opérateur, valeur); le tri porte
+        sur une colonne de SORTABLE_FIELDS puis sur rowid. `after` est la clé
+        (valeur de tri, rowid) de la dernière ligne de la page précédente.
+        Renvoie (lignes, clé de la dernière ligne ou None, total filtré).
+        """
+        clauses, params = [], []
+        for column, operator, value in filters or []:
+            clauses.append(f'{column} {operator} ?')
+            params.append(value)
+        count_where, count_params = ' AND '.join(clauses), list(params)
+
+        if sort is not None and sort not in SORTABLE_FIELDS[table]:
+            raise ValueError(f"Tri impossible sur le champ {sort}")
+        # Tri sur la colonne nue pour que SQLite parcoure son index (NULL en tête en ASC, en queue en DESC)
+        order_key = sort or 'rowid'
+        direction = 'DESC' if descending else 'ASC'
+        if after is not None:
+            comparison = '<' if descending else '>'
+            if sort and after[0] is None:
+                clauses.append(f'({sort} IS NULL AND rowid {comparison} ?)' if descending else
+                               f'({sort} IS NOT NULL OR rowid {comparison} ?)')
+                params.append(after[1])
+            elif sort:
+                clauses.append(f'({sort} {comparison} ? OR ({sort} = ? AND rowid {comparison} ?)'
+                               + (f' OR {sort} IS NULL)' if descending else ')'))
+                params += [after[0], after[0], after[1]]
+            else:
+                clauses.append(f'rowid {comparison} ?')
+                params.append(after[1])
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        query = (f'SELECT rowid AS _rowid, {order_key} AS _sort_key, {", ".join(fields)} FROM {table}{where} '
+                 f'ORDER BY {order_key} {direction}, rowid {direction}')
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        conn = self._connect()
+        rows = conn.execute(query, params).fetchall()
+        last = (rows[-1]['_sort_key'], rows[-1]['_rowid']) if rows and limit is not None and len(rows) == limit else None
+        if after is None and last is None:
+            # Tout tient sur la première page: pas besoin de compter
+            total = len(rows)
+        else:
+            total = self._count(conn, table, count_where, count_params)
+        return [_to_dict(row, fields) for row in rows], last, total
+
+    def _count(self, conn, table, where, params):
+        """COUNT(*) filtré, mis en cache jusqu'à la prochaine écriture dans la table (version)"""
+        key = (table, self.table_version(table), where, tuple(params))
+        total = self._totals.get(key)
+        if total is None:
+            total = conn.execute(f'SELECT COUNT(*) FROM {table}' + (f' WHERE {where}' if where else ''),
+                                 params).fetchone()[0]
+            if len(self._totals) >= 256:
+                self._totals.clear()
+            self._totals[key] = total
+        return total
+
+    def get_meta(self, key, default=None):
+        row = self._connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def migrate_from_json(self, persons_file, presence_file, absent_file):
+        """Import unique des anciens fichiers JSON (ignoré si déjà effectué)"""
+        if self.get_meta('json_migrated'):
+            return False
+
+        def load(filename):
+            if os.path.exists(filename):
+                try:
+                    with open(filename, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+                except Exception as e:
+                    print(f"Erreur lors du chargement de {filename}: {e}")
+            return []
+
+        persons = load(persons_file)
+        presences = load(presence_file)
+        absents = load(absent_file)
+        with self._connect() as conn:
+            for person in persons:
+                self._insert(conn, 'persons', PERSON_FIELDS, person)
+            for presence in presences:
+                self._insert(conn, 'presences', PRESENCE_FIELDS, self._presence_row(presence), conflict='IGNORE')
+            for absent in absents:
+                self._insert(conn, 'absents', ABSENT_FIELDS, absent)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+        self.rebuild_stats()
+        print(f"✅ Migration JSON: {len(persons)} personne(s), {len(presences)} présence(s), {len(absents)} absent(s)")
+        return True
+
+
+if __name__ == '__main__':
+    # Migration manuelle: python store.py [dossier_data]
+    import sys
+    data_folder = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    store = Store(os.path.join(data_folder, 'pointage.db'))
+    store.migrate_from_json(os.path.join(data_folder, 'personnes.json'),
+                            os.path.join(data_folder, 'presence.json'),
+                            os.path.join(data_folder, 'absent.json'))
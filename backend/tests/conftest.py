@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# Les modules du backend sont à plat dans backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import Store  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / 'pointage.db'))
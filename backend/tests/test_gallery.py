@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+from file_utils import VersionConflict
+from gallery import (ENCODING_SIZE, FaceGallery, gallery_generation, load_gallery, remove_persons,
+                     save_gallery, set_person_encodings, update_gallery)
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, ENCODING_SIZE)).astype(np.float32)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    encodings = vectors(3)
+    entries = [('p1', 'Ali'), ('p2', 'Zoé'), ('p1', 'Ali')]
+    save_gallery(path, encodings, entries, generation=7)
+    loaded, loaded_entries = load_gallery(path)
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, encodings)
+    assert loaded_entries == entries
+    assert gallery_generation(path) == 7
+
+
+def test_round_trip_empty(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    save_gallery(path, np.empty((0, ENCODING_SIZE)), [])
+    loaded, entries = load_gallery(path)
+    assert loaded.shape == (0, ENCODING_SIZE)
+    assert entries == []
+
+
+def test_save_rejects_mismatched_entries(tmp_path):
+    with pytest.raises(ValueError):
+        save_gallery(str(tmp_path / 'gallery.bin'), vectors(2), [('p1', 'Ali')])
+
+
+def test_load_rejects_truncated_file(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    save_gallery(path, vectors(4), [(f'p{i}', 'X') for i in range(4)])
+    with open(path, 'r+b') as f:
+        f.truncate(64 + 2 * ENCODING_SIZE * 4)
+    with pytest.raises(ValueError):
+        load_gallery(path)
+
+
+def test_update_increments_generation(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    assert gallery_generation(path) == 0
+    set_person_encodings(path, 'p1', 'Ali', vectors(2, 1), expected_generation=0)
+    assert gallery_generation(path) == 1
+    set_person_encodings(path, 'p2', 'Zoé', vectors(1, 2))
+    set_person_encodings(path, 'p1', 'Ali', vectors(1, 3), expected_generation=2)
+    assert gallery_generation(path) == 3
+    encodings, entries = load_gallery(path)
+    assert entries == [('p2', 'Zoé'), ('p1', 'Ali')]
+    np.testing.assert_array_equal(encodings[1], vectors(1, 3)[0])
+    remove_persons(path, ['p2'])
+    assert load_gallery(path)[1] == [('p1', 'Ali')]
+    assert gallery_generation(path) == 4
+
+
+def test_stale_generation_raises_conflict(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    set_person_encodings(path, 'p1', 'Ali', vectors(1))
+    set_person_encodings(path, 'p2', 'Zoé', vectors(1, 1))
+    with pytest.raises(VersionConflict):
+        set_person_encodings(path, 'p3', 'Léa', vectors(1, 2), expected_generation=1)
+    assert gallery_generation(path) == 2
+    assert [entry[0] for entry in load_gallery(path)[1]] == ['p1', 'p2']
+
+
+def test_failed_change_leaves_file_intact(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    set_person_encodings(path, 'p1', 'Ali', vectors(1))
+    with open(path, 'rb') as f:
+        before = f.read()
+
+    def change(encodings, entries):
+        raise RuntimeError('échec')
+    with pytest.raises(RuntimeError):
+        update_gallery(path, change)
+    with open(path, 'rb') as f:
+        assert f.read() == before
+    assert [name for name in os.listdir(tmp_path) if not name.startswith('gallery.bin')] == []
+
+
+def test_face_gallery_refresh_and_search(tmp_path):
+    path = str(tmp_path / 'gallery.bin')
+    gallery = FaceGallery(path)
+    assert not gallery.refresh()
+    assert gallery.search(vectors(1)[0]) == []
+
+    base = vectors(2, 5)
+    # Trois modèles pour p1, proches les uns des autres: la recherche ne renvoie p1 qu'une fois
+    templates = base[0] + 0.01 * vectors(3, 6)
+    set_person_encodings(path, 'p1', 'Ali', templates)
+    set_person_encodings(path, 'p2', 'Zoé', base[1:])
+    assert gallery.refresh()
+    assert not gallery.refresh()
+    assert len(gallery) == 4
+
+    results = gallery.search_many([base[0], base[1]], k=2)
+    assert [r[0] for r in results[0]] == ['p1', 'p2']
+    assert [r[0] for r in results[1]] == ['p2', 'p1']
+    assert results[1][0][2] == pytest.approx(0, abs=1e-5)
+    assert gallery.match(base[1])[:2] == ('p2', 'Zoé')
+    assert gallery.match(-base[1])[:2] == (None, None)
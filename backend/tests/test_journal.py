@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from file_utils import release_lock, try_lock
+from journal import PresenceJournal
+
+
+@pytest.fixture
+def today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def presence(person_id, date, heure='08:00:00', **extra):
+    return dict({'person_id': person_id, 'nom': f'Nom {person_id}', 'date': date, 'heure': heure}, **extra)
+
+
+def write_orphan(folder, name, presences):
+    with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(p) + '\n' for p in presences)
+
+
+def test_add_rejects_same_day_duplicate(store, tmp_path, today):
+    journal = PresenceJournal(store, str(tmp_path))
+    assert journal.add(presence('p1', today))
+    assert not journal.add(presence('p1', today, '09:00:00'))
+    assert journal.add(presence('p2', today))
+    # Sans identifiant, aucune présence n'en masque une autre
+    assert journal.add(presence('', today))
+    assert journal.add(presence('', today))
+    assert len(journal.pending()) == 4
+    assert [p['person_id'] for p in journal.pending(person_id='p1')] == ['p1']
+    journal.close()
+
+
+def test_compact_moves_pending_to_store(store, tmp_path, today):
+    journal = PresenceJournal(store, str(tmp_path))
+    journal.add(presence('p1', today))
+    journal.add(presence('p2', today))
+    assert journal.compact() == 2
+    assert journal.compact() == 0
+    assert journal.pending() == []
+    assert sorted(p['person_id'] for p in store.list_presences()) == ['p1', 'p2']
+    with open(tmp_path / f'presences-{today}.jsonl', encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+    # Après compaction, le doublon est toujours refusé (par le stockage cette fois)
+    assert not journal.add(presence('p1', today, '10:00:00'))
+    journal.close()
+    assert not os.path.exists(journal.path)
+    assert not os.path.exists(journal.path + '.lock')
+
+
+def test_recover_flushes_orphaned_journals(store, tmp_path):
+    write_orphan(tmp_path, 'presences.99999.jsonl', [presence('p1', '2026-01-05', id='a')])
+    write_orphan(tmp_path, 'presences.99999.compacting.jsonl', [presence('p2', '2026-01-05', id='b')])
+    # Ancien journal commun, avec une dernière ligne tronquée par un arrêt brutal
+    write_orphan(tmp_path, 'presences.jsonl', [presence('p3', '2026-01-05', id='c')])
+    with open(tmp_path / 'presences.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"person_id": "p4", "da')
+
+    journal = PresenceJournal(store, str(tmp_path))
+    assert sorted(p['id'] for p in store.list_presences()) == ['a', 'b', 'c']
+    for name in ('presences.99999.jsonl', 'presences.99999.compacting.jsonl', 'presences.jsonl'):
+        assert not os.path.exists(tmp_path / name)
+    journal.close()
+
+
+def test_recover_skips_journal_of_live_process(store, tmp_path):
+    path = os.path.join(tmp_path, 'presences.99999.jsonl')
+    write_orphan(tmp_path, 'presences.99999.jsonl', [presence('p1', '2026-01-05', id='a')])
+    lock = try_lock(path)
+    try:
+        journal = PresenceJournal(store, str(tmp_path))
+        assert store.list_presences() == []
+        assert os.path.exists(path)
+        journal.close()
+    finally:
+        release_lock(lock)
+
+
+def test_duplicate_from_other_journal_is_rejected(store, tmp_path, today):
+    # Deux workers: chacun son journal, le même stockage
+    first = PresenceJournal(store, str(tmp_path), name='worker1')
+    second = PresenceJournal(store, str(tmp_path), name='worker2')
+    assert first.add(presence('p1', today))
+    assert not second.add(presence('p1', today, '08:00:01'))
+    first.close()
+    second.close()
+    assert len(store.list_presences(person_id='p1')) == 1
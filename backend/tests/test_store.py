@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from store import Store
+
+
+def add_persons(store, postes):
+    for i, poste in enumerate(postes):
+        store.add_person({'id': str(i), 'nom': f'Personne {i}', 'poste': poste})
+
+
+def read_pages(store, sort, descending, limit, filters=None):
+    ids, after = [], None
+    while True:
+        rows, after, total = store.page('persons', ['id'], filters, sort, descending, limit, after)
+        ids += [row['id'] for row in rows]
+        if after is None:
+            return ids, total
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 2, 3, 7])
+def test_page_keyset_matches_full_read(store, descending, limit):
+    # Des NULL et des valeurs égales: le curseur doit départager par rowid sans perdre ni répéter de ligne
+    add_persons(store, [None, 'b', 'a', '', 'c', None, 'a', None, 'b', 'c'])
+    expected = [row['id'] for row in store.page('persons', ['id'], sort='poste', descending=descending)[0]]
+    ids, total = read_pages(store, 'poste', descending, limit)
+    assert ids == expected
+    assert total == 10
+    assert sorted(ids, key=int) == [str(i) for i in range(10)]
+
+
+def test_page_orders_nulls_first_ascending(store):
+    add_persons(store, ['b', None, 'a'])
+    rows, _, _ = store.page('persons', ['id', 'poste'], sort='poste')
+    assert [row.get('poste') for row in rows] == [None, 'a', 'b']
+
+
+def test_page_without_sort_follows_rowid(store):
+    add_persons(store, ['x'] * 5)
+    ids, total = read_pages(store, None, False, 2)
+    assert ids == ['0', '1', '2', '3', '4']
+    assert total == 5
+
+
+def test_page_filters_and_total(store):
+    add_persons(store, ['a', 'b', 'a', 'a', 'b'])
+    ids, total = read_pages(store, 'nom', False, 2, [('poste', '=', 'a')])
+    assert ids == ['0', '2', '3']
+    assert total == 3
+
+
+def test_page_total_follows_table_version(store):
+    add_persons(store, ['a', 'a', 'a'])
+    assert store.page('persons', ['id'], limit=1)[2] == 3
+    store.add_person({'id': 'new', 'nom': 'Nouveau'})
+    assert store.page('persons', ['id'], limit=1)[2] == 4
+
+
+def test_page_rejects_unknown_sort(store):
+    with pytest.raises(ValueError):
+        store.page('persons', ['id'], sort='telephone')
+
+
+def test_migration_removes_duplicate_presences(tmp_path):
+    path = str(tmp_path / 'pointage.db')
+    Store(path)
+    # Base d'avant l'index unique: doublons du jour et person_id vides
+    conn = sqlite3.connect(path)
+    conn.execute('DROP INDEX idx_presences_person_date_unique')
+    conn.execute('CREATE INDEX idx_presences_person_date ON presences(person_id, date)')
+    rows = [('1', 'p1', '2026-01-05', '08:00:00'), ('2', 'p1', '2026-01-05', '09:00:00'),
+            ('3', 'p2', '2026-01-05', '08:30:00'), ('4', '', '2026-01-05', '10:00:00'),
+            ('5', '', '2026-01-05', '11:00:00')]
+    conn.executemany("INSERT INTO presences (id, person_id, nom, date, heure) VALUES (?, ?, 'X', ?, ?)", rows)
+    conn.execute("DELETE FROM meta WHERE key = 'presences_unique'")
+    conn.commit()
+    conn.close()
+
+    store = Store(path)
+    presences = store.list_presences()
+    assert [p['id'] for p in presences] == ['1', '3', '4', '5']
+    assert store.count_presences() == 4
+    with pytest.raises(sqlite3.IntegrityError):
+        with store._connect() as conn:
+            conn.execute("INSERT INTO presences (id, person_id, nom, date) VALUES ('6', 'p1', 'X', '2026-01-05')")
+
+
+def test_migrate_from_json_runs_once(store, tmp_path):
+    persons = tmp_path / 'personnes.json'
+    presences = tmp_path / 'presence.json'
+    persons.write_text('[{"id": "p1", "nom": "Ali", "departement": "RH"}]', encoding='utf-8')
+    presences.write_text('[{"id": "a", "person_id": "p1", "nom": "Ali", "date": "2026-01-05", "heure": "08:00:00"},'
+                         ' {"id": "b", "person_id": "p1", "nom": "Ali", "date": "2026-01-05", "heure": "09:00:00"}]',
+                         encoding='utf-8')
+    assert store.migrate_from_json(str(persons), str(presences), str(tmp_path / 'absent.json'))
+    assert not store.migrate_from_json(str(persons), str(presences), str(tmp_path / 'absent.json'))
+    assert store.get_person('p1')['nom'] == 'Ali'
+    assert [p['id'] for p in store.list_presences()] == ['a']
+    assert store.person_stats('p1')['count'] == 1
+
+
+def test_count_presences_from_aggregates(store):
+    store.add_presences([
+        {'id': '1', 'person_id': 'p1', 'nom': 'A', 'date': '2026-01-05', 'heure': '08:00:00'},
+        {'id': '2', 'person_id': 'p1', 'nom': 'A', 'date': '2026-01-05', 'heure': '09:00:00'},
+        {'id': '3', 'person_id': 'p2', 'nom': 'B', 'date': '2026-01-06', 'heure': '08:00:00'},
+    ])
+    assert store.count_presences() == 2
+    assert store.count_presences(date='2026-01-06') == 1
+    assert store.count_presences(date_from='2026-01-07') == 0
+
+
+def test_claim_presence(store):
+    assert store.claim_presence('p1', '2026-01-05')
+    assert not store.claim_presence('p1', '2026-01-05')
+    store.release_presence_claim('p1', '2026-01-05')
+    assert store.claim_presence('p1', '2026-01-05')
+    store.add_presences([{'id': '1', 'person_id': 'p2', 'nom': 'B', 'date': '2026-01-05', 'heure': '08:00:00'}])
+    assert not store.claim_presence('p2', '2026-01-05')